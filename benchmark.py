@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Headless: no window, no sound card and no MIDI device are needed
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from main import ArrowGame
+from scripts.chart import Chart
+from scripts.clock import SongClock
+from scripts.midi import select_player
+
+# Frames played before allocations are counted, so that anything built on
+# first use is already there
+ALLOCATION_WARMUP = 120
+
+
+class SteppedTime:
+    # A time source that only moves when told to, in seconds like perf_counter
+    def __init__(self):
+        self.seconds = 0
+
+    def __call__(self):
+        return self.seconds
+
+    def advance(self, ms):
+        self.seconds += ms / 1000
+
+
+class AutoPlayer:
+    # Presses every arrow's key at exactly the arrow's time, from start on
+    def __init__(self, game, start=0):
+        self.game = game
+        self.song = game.arrows_area.song
+        chart = self.song.chart
+        self.cursors = [
+            int(np.searchsorted(chart.time[lane], start)) for lane in chart.lanes
+        ]
+
+    def update(self, now):
+        chart = self.song.chart
+        for group, lane in enumerate(chart.lanes):
+            cursor = self.cursors[group]
+            while cursor < len(lane) and chart.time[lane[cursor]] <= now:
+                stamp = int(chart.time[lane[cursor]])
+                self.game.input.play_arrow_for_group(group, stamp)
+                self.game.arrows_area.controls.stop_glow(group)
+                cursor += 1
+            self.cursors[group] = cursor
+
+
+def peak_memory():
+    # Peak resident set size of the process in MB
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentiles(samples, scale=1000):
+    samples = np.asarray(samples) * scale
+    if not len(samples):
+        return None
+    return {
+        "mean": round(float(samples.mean()), 3),
+        "p50": round(float(np.percentile(samples, 50)), 3),
+        "p95": round(float(np.percentile(samples, 95)), 3),
+        "p99": round(float(np.percentile(samples, 99)), 3),
+        "max": round(float(samples.max()), 3),
+    }
+
+
+def kept_since(snapshot):
+    # Bytes allocated since snapshot and still alive, leaving out this
+    # script's own bookkeeping
+    ignore = [
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ]
+    now = tracemalloc.take_snapshot().filter_traces(ignore)
+    stats = now.compare_to(snapshot.filter_traces(ignore), "filename")
+    return sum(stat.size_diff for stat in stats)
+
+
+def play(
+    game,
+    song_file,
+    difficulty,
+    realtime,
+    stepped,
+    skip=0,
+    max_frames=None,
+    trace_allocations=False,
+):
+    # Plays from skip, in song milliseconds, to the end of the song or for at
+    # most max_frames frames. Skipping ahead needs the stepped clock.
+    # trace_allocations counts the memory every frame allocates, which slows
+    # the frames down.
+    begin = time.perf_counter()
+    compiled = game.charts.load(song_file, difficulty)
+    loaded = time.perf_counter()
+    judgements = dict(game.score.judgements)
+    game.start_song(compiled)
+    setup = time.perf_counter()
+
+    if skip:
+        stepped.advance(skip)
+    bot = AutoPlayer(game, skip)
+    end = (compiled.duration + compiled.INTRO) * 1000 + 1000
+
+    updates, renders, frames = [], [], []
+    allocated = []
+    kept = None
+    lag = 0
+    previous = next_frame = time.perf_counter()
+    while game.song_clock.now() < end and len(frames) != max_frames:
+        # Only steady play counts, not the collection at the end of the song
+        measure = (
+            trace_allocations
+            and len(frames) >= ALLOCATION_WARMUP
+            and not game.arrows_area.song.ended
+        )
+        if measure:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                first = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        elif tracemalloc.is_tracing():
+            kept = kept_since(first)
+            tracemalloc.stop()
+
+        start = time.perf_counter()
+        if realtime:
+            lag = min(lag + (start - previous) * 1000, game.MAX_LAG)
+            previous = start
+            ticks = int(lag // game.TICK)
+            lag -= ticks * game.TICK
+        else:
+            stepped.advance(game.TICK)
+            ticks = 1
+
+        for _ in range(ticks):
+            bot.update(game.song_clock.now())
+            game.update_screen()
+            game.frame += 1
+        game.sequencer.flush()
+        updated = time.perf_counter()
+
+        game.window.update()
+        game.render_screen(lag / game.TICK)
+        game.window.render()
+        rendered = time.perf_counter()
+
+        if measure:
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+
+        updates.append(updated - start)
+        renders.append(rendered - updated)
+        frames.append(rendered - start)
+
+        if realtime and game.frame_rate:
+            next_frame = max(next_frame + 1 / game.frame_rate, time.perf_counter())
+            game.wait(next_frame)
+
+    if tracemalloc.is_tracing():
+        kept = kept_since(first)
+        tracemalloc.stop()
+    played = game.arrows_area.song.chart
+    game.arrows_area.reset()
+    game.collect_garbage()
+    return {
+        "song": Path(song_file).stem,
+        "difficulty": difficulty,
+        "arrows": len(played),
+        "hit": int(np.count_nonzero(played.state & Chart.PLAYING)),
+        "judgements": {
+            name: count - judgements[name]
+            for name, count in game.score.judgements.items()
+        },
+        "frames": len(frames),
+        "load_ms": round((loaded - begin) * 1000, 3),
+        "setup_ms": round((setup - loaded) * 1000, 3),
+        "frame_ms": percentiles(frames),
+        "update_ms": percentiles(updates),
+        "render_ms": percentiles(renders),
+        "peak_memory_mb": peak_memory(),
+        "allocated_bytes": percentiles(allocated, 1),
+        "kept_bytes": kept,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Autoplay every song headlessly and report frame times as JSON"
+    )
+    parser.add_argument("--songs", type=Path, default=Path("data") / "songs")
+    parser.add_argument(
+        "--song",
+        action="append",
+        help="only play this song (file name without .json), can be repeated",
+    )
+    parser.add_argument(
+        "--difficulty",
+        type=int,
+        action="append",
+        help="only play this difficulty, can be repeated",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="play at normal speed instead of as fast as possible",
+    )
+    parser.add_argument(
+        "--fps",
+        type=int,
+        default=ArrowGame.FRAME_RATE,
+        help="frames drawn per second in real time, 0 draws as often as possible",
+    )
+    parser.add_argument("--dirty-rects", action="store_true")
+    parser.add_argument(
+        "--allocation-budget",
+        type=int,
+        help="count the memory allocated while playing and fail if the p99 "
+        "frame allocates more than this many bytes, or more are still kept "
+        "at the end of the song",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="write the JSON here")
+    args = parser.parse_args()
+
+    select_player("null")
+    stepped = None if args.realtime else SteppedTime()
+    game = ArrowGame(
+        dirty_rects=args.dirty_rects,
+        song_clock=SongClock() if args.realtime else SongClock(stepped),
+        frame_rate=args.fps,
+    )
+
+    runs = []
+    failures = 0
+    for song_file in sorted(args.songs.glob("*.json")):
+        if args.song and song_file.stem not in args.song:
+            continue
+        with song_file.open() as f:
+            levels = len(json.load(f)["levels"])
+        for difficulty in range(levels):
+            if args.difficulty and difficulty not in args.difficulty:
+                continue
+            run = play(
+                game,
+                song_file,
+                difficulty,
+                args.realtime,
+                stepped,
+                trace_allocations=args.allocation_budget is not None,
+            )
+            runs.append(run)
+            print(
+                f"{run['song']} [{difficulty}]: p50 {run['frame_ms']['p50']} ms, "
+                f"p99 {run['frame_ms']['p99']} ms over {run['frames']} frames",
+                file=sys.stderr,
+            )
+            if args.allocation_budget is None:
+                continue
+
+            allocated = run["allocated_bytes"]["p99"]
+            print(
+                f"{run['song']} [{difficulty}]: p99 frame allocates {allocated} "
+                f"bytes, {run['kept_bytes']} bytes kept",
+                file=sys.stderr,
+            )
+            if max(allocated, run["kept_bytes"]) > args.allocation_budget:
+                failures += 1
+
+    report = json.dumps(
+        {
+            "mode": "realtime" if args.realtime else "fast",
+            "tick_rate": ArrowGame.TICK_RATE,
+            "frame_rate": args.fps if args.realtime else None,
+            "runs": runs,
+            "peak_memory_mb": peak_memory(),
+        },
+        indent=2,
+    )
+    if args.output:
+        args.output.write_text(report + "\n")
+    else:
+        print(report)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
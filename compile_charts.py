@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from scripts.chart import compile_song
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile every song in the library into cached charts"
+    )
+    parser.add_argument("--songs", type=Path, default=Path("data") / "songs")
+    parser.add_argument("--cache", type=Path, default=Path("data") / "cache" / "charts")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="recompile up to date charts"
+    )
+    args = parser.parse_args()
+
+    song_files = sorted(args.songs.glob("*.json"))
+    failures = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        jobs = {
+            executor.submit(compile_song, args.cache, song_file, args.force): song_file
+            for song_file in song_files
+        }
+        for job in as_completed(jobs):
+            song_file = jobs[job]
+            try:
+                built, seconds = job.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED   {song_file.name}: {e!r}")
+                continue
+
+            if built:
+                levels = ", ".join(map(str, built))
+                print(f"compiled {song_file.name} [{levels}] in {seconds:.3f}s")
+            else:
+                print(f"current  {song_file.name} in {seconds:.3f}s")
+
+    print(
+        f"{len(song_files)} songs, {failures} failed, "
+        f"{time.perf_counter() - start:.3f}s total"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,77 +1,297 @@
-import pygame
+import argparse
+import gc
+import time
 from pathlib import Path
-from functools import lru_cache
+from functools import cached_property, lru_cache
 
-from scripts.input import InputManager
-from scripts.window import Window
-from scripts.arrows import ArrowsArea
-from scripts.score import Score
-from scripts.menu import Menu
-from scripts.levellist import LevelList
+from scripts.startup import startup
+
+with startup.phase("import pygame"):
+    import pygame
+
+# Each module is timed on its own, imported before the modules that use it so
+# its cost isn't counted in theirs. numpy already came in with pygame.
+with startup.phase("import scripts.profiler"):
+    from scripts.profiler import profiler
+with startup.phase("import scripts.output"):
+    from scripts.output import BACKENDS
+with startup.phase("import scripts.midi"):
+    from scripts.midi import select_player
+with startup.phase("import scripts.chart"):
+    from scripts.chart import ChartCache
+with startup.phase("import scripts.score"):
+    from scripts.score import Score
+with startup.phase("import scripts.arrows"):
+    from scripts.arrows import ArrowsArea
+with startup.phase("import scripts.synth"):
+    from scripts.synth import BackingCache
+with startup.phase("import scripts.sequencer"):
+    from scripts.sequencer import Sequencer
+with startup.phase("import scripts.prefetch"):
+    from scripts.prefetch import ChartPrefetcher
+with startup.phase("import scripts.loading"):
+    from scripts.loading import Loading
+with startup.phase("import scripts.levellist"):
+    from scripts.levellist import LevelList
+with startup.phase("import scripts.menu"):
+    from scripts.menu import Menu
+with startup.phase("import scripts.input"):
+    from scripts.input import InputManager
+with startup.phase("import scripts.window"):
+    from scripts.window import Window
+with startup.phase("import scripts.clock"):
+    from scripts.clock import SongClock
+with startup.phase("import scripts.glyphs"):
+    from scripts.glyphs import Glyphs
 
 
 class ArrowGame:
 
     FRAME_RATE = 60
+    # Game logic always runs at this rate, however often frames are drawn
+    TICK_RATE = 60
+    TICK = 1000 / TICK_RATE
+    # Never try to catch up on more than this many milliseconds at once
+    MAX_LAG = 250
 
-    def __init__(self):
-        pygame.init()
-        pygame.mixer.init()
+    def __init__(
+        self,
+        dirty_rects=False,
+        song_clock=None,
+        frame_rate=FRAME_RATE,
+        audio_backing=False,
+    ):
+        with startup.phase("pygame.init"):
+            pygame.init()
+            pygame.mixer.init()
 
-        self.click = pygame.mixer.Sound("data/sounds/click.wav")
-        self.select = pygame.mixer.Sound("data/sounds/select.wav")
+        with startup.phase("load sounds"):
+            self.click = pygame.mixer.Sound("data/sounds/click.wav")
+            self.select = pygame.mixer.Sound("data/sounds/select.wav")
 
         self.accent_colour = (200, 55, 181)
         self.screen = "menu"
 
-        self.clock = pygame.time.Clock()
+        self.frame_rate = frame_rate
         self.frame = 0
+        self.song_clock = song_clock or SongClock()
+        self.sequencer = Sequencer(self.song_clock)
 
         self.data = Path("data")
+        self.charts = ChartCache(self.data / "cache" / "charts")
+        self.prefetcher = ChartPrefetcher(self.charts)
+        self.backing_tracks = None
+        if audio_backing:
+            self.backing_tracks = BackingCache(
+                self.data / "cache" / "audio", pygame.mixer.get_init()[0]
+            )
 
-        self.window = Window(self)
+        with startup.phase("open window"):
+            self.window = Window(self, dirty_rects)
         self.input = InputManager(self)
-        self.arrows_area = ArrowsArea(self)
-        self.score = Score(self)
-        self.menu = Menu(self)
-        self.level_list = LevelList(self)
+
+    # Screens are only built the first time they are needed
+
+    @cached_property
+    def arrows_area(self):
+        with startup.phase("build game screen"):
+            return ArrowsArea(self)
+
+    @cached_property
+    def score(self):
+        with startup.phase("build score"):
+            return Score(self)
+
+    @cached_property
+    def menu(self):
+        with startup.phase("build menu"):
+            return Menu(self)
+
+    @cached_property
+    def level_list(self):
+        with startup.phase("build level list"):
+            return LevelList(self)
+
+    @cached_property
+    def loading(self):
+        with startup.phase("build loading screen"):
+            return Loading(self)
 
     @lru_cache
     def load_image(self, filename):
         return pygame.image.load(self.data / "images" / filename)
 
+    @lru_cache
+    def load_font(self, family, size):
+        return pygame.font.Font(self.data / "fonts" / family, size)
+
+    @lru_cache
+    def load_glyphs(self, family, size, colour):
+        return Glyphs(self.load_font(family, size), colour)
+
+    @lru_cache(maxsize=256)
+    def render_text(self, font, text, antialias, colour):
+        # The returned surface is shared, callers must not draw onto it
+        return font.render(text, antialias, colour)
+
     def mainloop(self):
+        previous = next_frame = time.perf_counter()
+        lag = 0
         while True:
+            profiler.start_frame()
             self.input.process_inputs()
+            profiler.mark("input")
+
+            current = time.perf_counter()
+            lag = min(lag + (current - previous) * 1000, self.MAX_LAG)
+            previous = current
+
+            while lag >= self.TICK:
+                self.update_screen()
+                self.frame += 1
+                lag -= self.TICK
+            self.sequencer.flush()
+            profiler.mark("update")
 
+            # The overlay covers retained content, which would be cleared
+            # along with it and not drawn again
+            if profiler.enabled:
+                self.window.invalidate()
             self.window.update()
 
-            self.show_screen()
+            self.render_screen(lag / self.TICK)
+            profiler.mark("render")
+            profiler.render(self)
+            profiler.mark("overlay")
 
             self.window.render()
+            startup.report()
+            profiler.mark("display")
 
-            self.clock.tick(self.FRAME_RATE)
-            self.frame += 1
+            if self.frame_rate:
+                next_frame = max(next_frame + 1 / self.frame_rate, time.perf_counter())
+                self.wait(next_frame)
+            profiler.mark("wait")
 
-    def show_screen(self):
+    def wait(self, until):
+        # Keep pulling input while waiting so key presses are stamped when
+        # they happen, not when the next frame starts
+        while True:
+            self.input.collect()
+            remaining = until - time.perf_counter()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.001))
+
+    def update_screen(self):
         if self.screen == "game":
             self.arrows_area.update(self.frame)
-            self.arrows_area.render()
             self.score.update(self.frame)
-            self.score.render()
+            if self.arrows_area.song.ended:
+                self.collect_garbage()
         elif self.screen == "menu":
             self.menu.update(self.frame)
-            self.menu.render()
         elif self.screen == "list":
             self.level_list.update(self.frame)
+        elif self.screen == "loading":
+            self.loading.update(self.frame)
+
+    def render_screen(self, alpha=1):
+        # alpha is how far between the last two updates this frame is drawn
+        if self.screen == "game":
+            self.arrows_area.render(alpha)
+            self.score.render()
+        elif self.screen == "menu":
+            self.menu.render()
+        elif self.screen == "list":
             self.level_list.render()
+        elif self.screen == "loading":
+            self.loading.render()
 
     def play_song(self, song_path, difficulty=0):
+        compiled = self.prefetcher.get(song_path, difficulty)
+        if compiled is not None and (
+            self.backing_tracks is None or self.backing_tracks.cached(compiled)
+        ):
+            self.start_song(compiled)
+        else:
+            self.screen = "loading"
+            self.loading.start(song_path, difficulty)
+
+    def start_song(self, compiled):
         self.screen = "game"
-        self.arrows_area.song.load(song_path, difficulty)
+        self.arrows_area.song.setup(compiled)
+        self.pause_garbage_collection()
         self.arrows_area.song.play()
 
+    def pause_garbage_collection(self):
+        # Everything loaded so far outlives the song, so it is moved out of
+        # the collector's sight, and no collection runs until a safe point
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+
+    def collect_garbage(self):
+        # Safe points are the end of the song and leaving it
+        if not gc.isenabled():
+            gc.unfreeze()
+            gc.enable()
+            gc.collect()
+
 
 if __name__ == "__main__":
-    game = ArrowGame()
-    game.mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dirty-rects",
+        action="store_true",
+        help="only redraw and push the parts of the window that changed",
+    )
+    parser.add_argument(
+        "--fps",
+        type=int,
+        default=ArrowGame.FRAME_RATE,
+        help="frames drawn per second, 0 draws as often as possible",
+    )
+    parser.add_argument(
+        "--midi",
+        choices=BACKENDS,
+        default="device",
+        help="where notes are sent: a MIDI device, nowhere, or a recording",
+    )
+    parser.add_argument(
+        "--midi-device",
+        type=int,
+        help="MIDI output device id, the system default if left out",
+    )
+    parser.add_argument(
+        "--midi-record",
+        type=Path,
+        help="file the record backend writes events to, kept in memory otherwise",
+    )
+    parser.add_argument(
+        "--audio-backing",
+        action="store_true",
+        help="render the backing instruments to audio instead of sending them"
+        " over MIDI",
+    )
+    parser.add_argument(
+        "--startup-trace",
+        action="store_true",
+        help="print how long each import and startup step took",
+    )
+    args = parser.parse_args()
+    startup.enabled = args.startup_trace
+
+    if args.midi == "device":
+        select_player("device", device_id=args.midi_device)
+    elif args.midi == "record":
+        select_player("record", path=args.midi_record)
+    else:
+        select_player(args.midi)
+
+    game = ArrowGame(
+        dirty_rects=args.dirty_rects,
+        frame_rate=args.fps,
+        audio_backing=args.audio_backing,
+    )
+    game.mainloop()
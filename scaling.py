@@ -0,0 +1,142 @@
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+# Imported first so the dummy SDL drivers are set up before pygame is
+from benchmark import SteppedTime, play
+
+import numpy as np
+
+from main import ArrowGame
+from scripts.chart import ChartCache, CompiledChart
+from scripts.clock import SongClock
+from scripts.midi import select_player
+from scripts.synthetic import write_song
+
+
+def exponent(sizes, times):
+    # Slope of log(time) against log(size), 1 is linear
+    return float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that loading and playing songs scales with their size"
+    )
+    parser.add_argument(
+        "--notes",
+        type=int,
+        nargs="+",
+        default=[2000, 4000, 8000, 16000, 32000],
+        help="note counts of the generated songs",
+    )
+    parser.add_argument("--chord-size", type=int, default=2)
+    parser.add_argument("--instruments", type=int, default=4)
+    parser.add_argument(
+        "--frames", type=int, default=600, help="frames played from each song's middle"
+    )
+    parser.add_argument(
+        "--max-exponent",
+        type=float,
+        default=1.25,
+        help="fail if load time grows faster than notes to this power",
+    )
+    parser.add_argument(
+        "--max-frame-growth",
+        type=float,
+        default=1.5,
+        help="fail if the median update or render time of any size is more than "
+        "this many times that of the smallest",
+    )
+    parser.add_argument("--keep", type=Path, help="write the generated songs here")
+    parser.add_argument("-o", "--output", type=Path, help="write the JSON here")
+    args = parser.parse_args()
+
+    select_player("null")
+    stepped = SteppedTime()
+    game = ArrowGame(song_clock=SongClock(stepped), frame_rate=0)
+    # Built now so the first song's setup isn't charged for it
+    game.arrows_area
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.keep or Path(tmp)
+        # Always compiled from the MIDI, never read from a previous run's cache
+        game.charts = ChartCache(Path(tmp) / "charts")
+
+        runs = []
+        for notes in args.notes:
+            song_file = write_song(
+                directory,
+                f"synthetic-{notes}",
+                notes,
+                chord_size=args.chord_size,
+                instruments=args.instruments,
+            )
+            with song_file.open() as f:
+                difficulty = len(json.load(f)["levels"]) - 1
+
+            # Density stays the same as songs get longer, so the middle of
+            # each one is as busy as any other's
+            seconds = notes / (args.chord_size * args.instruments * 10)
+            run = play(
+                game,
+                song_file,
+                difficulty,
+                False,
+                stepped,
+                skip=int((CompiledChart.INTRO + seconds / 2) * 1000),
+                max_frames=args.frames,
+            )
+            run["notes"] = notes
+            runs.append(run)
+            print(
+                f"{notes:>7} notes: load {run['load_ms']:9.1f} ms, "
+                f"setup {run['setup_ms']:8.1f} ms, "
+                f"update p50 {run['update_ms']['p50']:6.3f} ms, "
+                f"render p50 {run['render_ms']['p50']:6.3f} ms",
+                file=sys.stderr,
+            )
+
+    sizes = [run["notes"] for run in runs]
+    load_exponent = exponent(sizes, [run["load_ms"] + run["setup_ms"] for run in runs])
+    update_growth = (
+        max(r["update_ms"]["p50"] for r in runs) / runs[0]["update_ms"]["p50"]
+    )
+    render_growth = (
+        max(r["render_ms"]["p50"] for r in runs) / runs[0]["render_ms"]["p50"]
+    )
+
+    failures = []
+    if load_exponent > args.max_exponent:
+        failures.append(f"load time grows as notes^{load_exponent:.2f}")
+    if update_growth > args.max_frame_growth:
+        failures.append(f"update time grows {update_growth:.2f}x")
+    if render_growth > args.max_frame_growth:
+        failures.append(f"render time grows {render_growth:.2f}x")
+
+    report = json.dumps(
+        {
+            "load_exponent": round(load_exponent, 3),
+            "update_growth": round(update_growth, 3),
+            "render_growth": round(render_growth, 3),
+            "failures": failures,
+            "runs": runs,
+        },
+        indent=2,
+    )
+    if args.output:
+        args.output.write_text(report + "\n")
+
+    print(
+        f"load ~ notes^{load_exponent:.2f}, update x{update_growth:.2f}, "
+        f"render x{render_growth:.2f}"
+    )
+    for failure in failures:
+        print(f"FAILED   {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
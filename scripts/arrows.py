@@ -1,10 +1,11 @@
-import json
-from collections import defaultdict
-
 import pygame
 import math
+import numpy as np
 
-from .midi import MidiFile
+from .chart import Chart
+from .midi import Note, NoteScheduler, initialise_player
+from .profiler import profiler
+from .score import Score
 from functools import lru_cache
 
 
@@ -12,6 +13,8 @@ class ArrowsArea:
     def __init__(self, game):
         self.game = game
         self.arrow_size = (75, 75)
+        # Arrow opacity is drawn in steps of this size from a shared table
+        self.alpha_step = 8
 
         self.starting_frame = None
 
@@ -36,15 +39,15 @@ class ArrowsArea:
         if self.starting_frame is None:
             self.starting_frame = frame
         self.controls.update(frame - self.starting_frame)
-        self.song.update(frame - self.starting_frame)
+        self.song.update(self.game.song_clock.now())
 
-    def render(self):
+    def render(self, alpha=1):
         self.image.fill((0, 0, 0))
 
         self.controls.render()
-        self.song.render()
+        self.song.render(alpha)
 
-        self.game.window.screen.blit(self.image, self.rect)
+        self.game.window.blit(self.image, self.rect)
 
     def get_x_pos_by_group(self, group):
         spacing = self.width // 4
@@ -59,16 +62,49 @@ class ArrowsArea:
         ).convert_alpha()
         return arrow_image
 
+    def alpha_frames(self, image):
+        frames = []
+        for alpha in range(0, 255 + self.alpha_step, self.alpha_step):
+            frame = image.copy()
+            frame.fill((255, 255, 255, min(alpha, 255)), None, pygame.BLEND_RGBA_MULT)
+            frames.append(frame)
+        return frames
+
+    def alpha_index(self, alpha):
+        return (int(alpha) + self.alpha_step // 2) // self.alpha_step
+
+    @lru_cache
+    def arrow_alpha_frames(self, group):
+        return self.alpha_frames(self.arrow_image_by_group(group))
+
+    def arrow_by_opacity(self, group, opacity):
+        return self.arrow_alpha_frames(group)[self.alpha_index(opacity)]
+
+    @lru_cache
+    def arrow_grow_frames(self, group):
+        # One frame for every whole pixel the arrow can grow by when hit
+        arrow_image = self.arrow_image_by_group(group)
+        return [
+            pygame.transform.scale(
+                arrow_image,
+                (self.arrow_size[0] + grow, self.arrow_size[1] + grow),
+            )
+            for grow in range(Arrow.ENLARGE_SIZE + 1)
+        ]
+
 
 class Controls:
     def __init__(self, arrows_area):
         self.arrows_area = arrows_area
         self.controls_y = 200
         self.glow_size = 13
+        self.glow_fade_frames = 20
 
-        self.glow_images = {}
-        self.glowing_groups = []
-        self.stop_glowing = []
+        # Per lane: the glow frame to draw, whether it is lit and how far
+        # through fading out it is
+        self.glow_images = [None] * Chart.LANES
+        self.glowing = [False] * Chart.LANES
+        self.glow_fade = [None] * Chart.LANES
 
         # CONTROL IMAGES
         self.up_arrow = pygame.transform.scale(
@@ -124,40 +160,47 @@ class Controls:
             ),
         ).convert_alpha()
 
+        self.glow_frames = [
+            self.arrows_area.alpha_frames(glow)
+            for glow in (self.left_glow, self.up_glow, self.down_glow, self.right_glow)
+        ]
+
     def glow(self, group):
-        self.glowing_groups.append(group)
+        self.glowing[group] = True
+        self.glow_fade[group] = None
 
     def stop_glow(self, group):
-        if not any(i[0] == i for i in self.stop_glowing):
-            self.stop_glowing.append([group, 1])
+        if self.glowing[group] and self.glow_fade[group] is None:
+            self.glow_fade[group] = self.glow_fade_frames
 
     def update(self, frame):
-        glows = (self.left_glow, self.up_glow, self.down_glow, self.right_glow)
-        for g in self.glowing_groups:
-            image = glows[g].copy()
-            alpha = 160 + (math.sin(0.5 * frame) + 1) * 30
-
-            for i in range(len(self.stop_glowing)):
-                if self.stop_glowing[i][0] == g:
-                    self.stop_glowing[i][1] -= 0.05
-                    if self.stop_glowing[i][1] <= 0:
-                        try:
-                            self.glowing_groups.remove(self.stop_glowing[i][0])
-                            self.glow_images.pop(self.stop_glowing[i][0])
-                            self.stop_glowing.remove(self.stop_glowing[i])
-                        except (ValueError, KeyError):
-                            pass
-                        return
-                    alpha = int(alpha * self.stop_glowing[i][1])
-                    break
-
-            image.fill((255, 255, 255, alpha), None, pygame.BLEND_RGBA_MULT)
-            self.glow_images[g] = image
+        with profiler.span("Controls.update"):
+            pulse = 160 + (math.sin(0.5 * frame) + 1) * 30
+            for g in range(Chart.LANES):
+                if not self.glowing[g]:
+                    self.glow_images[g] = None
+                    continue
+
+                alpha = pulse
+                if self.glow_fade[g] is not None:
+                    self.glow_fade[g] -= 1
+                    if self.glow_fade[g] <= 0:
+                        self.glowing[g] = False
+                        self.glow_fade[g] = None
+                        self.glow_images[g] = None
+                        continue
+                    alpha = alpha * self.glow_fade[g] / self.glow_fade_frames
+
+                self.glow_images[g] = self.glow_frames[g][
+                    self.arrows_area.alpha_index(alpha)
+                ]
 
     def render(self):
         arrows = (self.left_arrow, self.up_arrow, self.down_arrow, self.right_arrow)
 
-        for n, image in self.glow_images.items():
+        for n, image in enumerate(self.glow_images):
+            if image is None:
+                continue
             x = self.arrows_area.get_x_pos_by_group(n)
             self.arrows_area.image.blit(
                 image, (x - self.glow_size // 2, self.controls_y - self.glow_size // 2)
@@ -172,111 +215,222 @@ class Song:
     def __init__(self, arrows_area):
         self.arrows_area = arrows_area
         self.playing = False
-        self.frame = 0
-        self.start_frame = 0
-        self.playing_instruments = []
+        self.now = 0
+        self.previous_now = 0
+        self.render_now = 0
+        self.backing = None
+        self.backing_track = None
+        self.chart = Chart([], [], [])
+        self.arrows = []
+        self.enter_index = 0
+        self.retire_index = 0
+        self.lane_heads = [0] * Chart.LANES
         self.song_name = ""
         self.song_artist = ""
-
-    def load(self, song_file, difficulty=0):
-        with open(song_file) as f:
-            song_data = json.load(f)
-        self.song_name = song_data.get("name", "Unknown")
-        self.song_artist = song_data.get("artist", "Unknown")
-        self.song = MidiFile(
-            song_file.parent / song_data["midi"], tempo=song_data.get("tempo", 1)
+        self.name_surface = None
+        self.length = 0
+
+    def setup(self, compiled):
+        self.song_name = compiled.name
+        self.song_artist = compiled.artist
+        self.length = int((compiled.duration + compiled.INTRO) * 1000)
+
+        # Everything drawn while playing is made now, not on first use
+        name_font = self.arrows_area.game.load_font("Oswald-Regular.ttf", 20)
+        self.name_surface = self.arrows_area.game.render_text(
+            name_font,
+            " ".join(f"{self.song_name} | {self.song_artist}".upper()),
+            True,
+            (255, 255, 255),
         )
-        self.song.intro(3)
-        self.song.initialise_player()
-        self.playing_instruments = self.song.get_instruments_by_index(
-            *song_data["levels"][difficulty]
+        for group in range(Chart.LANES):
+            self.arrows_area.arrow_alpha_frames(group)
+            self.arrows_area.arrow_grow_frames(group)
+
+        # The backing track is played by the sequencer's thread, only the
+        # notes of arrows the player hits are sent from here
+        sequencer = self.arrows_area.game.sequencer
+        initialise_player(compiled.programs, sequencer)
+        self.backing = NoteScheduler(compiled.backing_time, compiled.backing_events)
+
+        # Or, if it has been rendered to audio, by the mixer
+        self.backing_track = None
+        if self.arrows_area.game.backing_tracks is not None:
+            self.backing_track = self.arrows_area.game.backing_tracks.load(compiled)
+            pygame.mixer.music.load(str(self.backing_track))
+
+        self.chart = Chart(
+            compiled.arrow_time, compiled.arrow_lane, compiled.arrow_duration
         )
-        self.arrows = []
-        self.frequencies = [
-            n.note
-            for n in sorted(
-                [
-                    n
-                    for i, notes in self.song.notes.items()
-                    for n in notes
-                    if i in self.playing_instruments
-                ],
-                key=lambda x: x.note,
-            )
-        ]
+        self.chart.reset(self.arrows_area.controls.controls_y, Arrow.SPEED)
 
         # load arrows
-        arrow_notes = [
-            n
-            for instrument, notes in self.song.notes.items()
-            for n in notes
-            if instrument in self.playing_instruments
+        notes = [
+            Note(sequencer, *row)
+            for row in zip(
+                compiled.note_time.tolist(),
+                compiled.note_pitch.tolist(),
+                compiled.note_duration.tolist(),
+                compiled.note_velocity.tolist(),
+                compiled.note_channel.tolist(),
+            )
+        ]
+        offsets = compiled.arrow_offsets.tolist()
+        self.arrows = [
+            Arrow(self, i, notes[start:end])
+            for i, (start, end) in enumerate(zip(offsets, offsets[1:]))
         ]
-        arrow_notes_by_time = defaultdict(list)
-        for note in arrow_notes:
-            arrow_notes_by_time[note.time].append(note)
-
-        for time, notes_group in arrow_notes_by_time.items():
-            self.arrows.append(Arrow(self, notes_group))
-
-    def get_group_by_note(self, notes):
-        step = (len(self.frequencies) - 1) // 4
-        group = 0
-        avg_note = sum(n.note for n in notes) / len(notes)
-        for i in range(step, step * 3 + 1, step):
-            if avg_note > self.frequencies[i]:
-                group += 1
-            else:
-                break
-        return group
 
-    def get_playable_arrows(self):
-        return [a for a in self.arrows if a.is_playable()]
+        self.enter_index = 0
+        self.retire_index = 0
+        self.lane_heads = [0] * Chart.LANES
 
-    def play(self):
-        self.playing = True
-        self.start_frame = self.frame
+        # Milliseconds between an arrow entering the bottom of the lane and
+        # its note
+        self.lookahead = (
+            int(
+                (self.arrows_area.height - self.arrows_area.controls.controls_y)
+                / Arrow.SPEED
+            )
+            + 1
+        )
 
-    def stop(self):
-        self.playing = False
+    def get_playable_arrow(self, group, stamp):
+        # stamp is the song time in milliseconds that the key went down
+        lane = self.chart.lanes[group]
+        head = self.lane_heads[group]
+        while head < len(lane) and self.chart.state[lane[head]] & (
+            Chart.PLAYING | Chart.FINISHED
+        ):
+            head += 1
+        self.lane_heads[group] = head
+
+        # An arrow whose window has closed, but that no update has marked as
+        # missed yet, must not swallow a press meant for the next one
+        while head < len(lane) and not self.arrows[lane[head]].is_playable(stamp):
+            if self.chart.time[lane[head]] >= stamp:
+                return None
+            head += 1
+
+        if head < len(lane):
+            return self.arrows[lane[head]]
 
     @property
-    def song_frame(self):
-        return self.frame - self.start_frame
+    def ended(self):
+        return self.playing and self.now > self.length
 
-    def update(self, frame):
-        self.frame = frame
+    def active_arrows(self):
+        return self.arrows[self.retire_index : self.enter_index]
 
-        if self.playing:
-            for instrument, notes in self.song.notes.items():
-                if instrument not in self.playing_instruments:
-                    for note in notes:
-                        note.update(self.song_frame)
+    def advance_window(self):
+        self.enter_index = self.chart.window(self.now, self.lookahead)
+        while (
+            self.retire_index < self.enter_index
+            and self.chart.state[self.retire_index] & Chart.RETIRED
+        ):
+            self.retire_index += 1
+
+    def play(self):
+        self.playing = True
+        self.now = self.previous_now = self.render_now = 0
+        self.arrows_area.game.song_clock.start()
+        if self.backing_track is not None:
+            pygame.mixer.music.play()
+            self.arrows_area.game.sequencer.play()
+        else:
+            self.arrows_area.game.sequencer.play(self.backing)
 
-            for arrow in self.arrows:
-                arrow.update(self.song_frame)
+    def stop(self):
+        self.playing = False
+        if self.backing_track is not None:
+            pygame.mixer.music.stop()
+        self.arrows_area.game.sequencer.stop()
+        self.arrows_area.game.song_clock.stop()
 
-    def render(self):
-        name_font = pygame.font.Font(
-            self.arrows_area.game.data / "fonts" / "Oswald-Regular.ttf", 20
-        )
+    def update(self, now):
+        # now is the song time in milliseconds, sampled once so that the
+        # whole update sees the same instant
+        self.previous_now = self.now
+        self.now = now
 
-        name_surface = name_font.render(
-            " ".join(f"{self.song_name} | {self.song_artist}".upper()),
-            True,
-            (255, 255, 255),
+        if self.playing:
+            if self.backing_track is not None and pygame.mixer.music.get_busy():
+                # The audio device's clock is the one the music really follows
+                self.arrows_area.game.song_clock.sync(pygame.mixer.music.get_pos())
+
+            self.advance_window()
+            window = slice(self.retire_index, self.enter_index)
+            time = self.chart.time[window]
+            state = self.chart.state[window]
+            opacity = self.chart.opacity[window]
+            y = self.chart.y[window]
+            target = self.arrows_area.controls.controls_y
+
+            playing = (state & Chart.PLAYING) != 0
+            with profiler.span("Song.update notes"):
+                for i in np.flatnonzero(playing & ((state & Chart.RETIRED) == 0)):
+                    self.arrows[self.retire_index + i].update(self.now)
+
+            with profiler.span("Song.update arrows"):
+                # Positions are derived from time, never accumulated frame by frame
+                moving = ~playing
+                y[moving] = target + (time[moving] - self.now) * Arrow.SPEED
+
+                missed = (
+                    moving
+                    & ((state & Chart.FINISHED) == 0)
+                    & (time < self.now - Score.HIT_WINDOW)
+                )
+                for _ in range(np.count_nonzero(missed)):
+                    self.arrows_area.game.score.miss()
+                state[missed] |= Chart.FINISHED
+
+                # Only arrows that were hit fade out once their note ends,
+                # missed ones keep scrolling until they leave the top
+                ended = playing & (self.now > time + self.chart.duration[window])
+                live = (state & Chart.FINISHED) == 0
+                fade_in = live & (y < 600) & (opacity < 230)
+                opacity[fade_in] = np.minimum(opacity[fade_in] + 16, 255)
+                opacity[live & (y > 600)] = 0
+                opacity[ended] = np.maximum(opacity[ended] - 25, 0)
+
+                done = ~live & (
+                    (moving & (y + self.arrows_area.arrow_size[1] < 0))
+                    | ((opacity == 0) & ended)
+                )
+                state[done] |= Chart.RETIRED
+
+    def render(self, alpha=1):
+        # Draw moving arrows where they are between the last two updates
+        self.render_now = self.previous_now + (self.now - self.previous_now) * alpha
+
+        window = slice(self.retire_index, self.enter_index)
+        time = self.chart.time[window]
+        state = self.chart.state[window]
+        playing = (state & Chart.PLAYING) != 0
+        y = np.where(
+            playing,
+            self.chart.y[window],
+            self.arrows_area.controls.controls_y
+            + (time - self.render_now) * Arrow.SPEED,
+        ).astype(np.int64)
+        ended = playing & (self.now > time + self.chart.duration[window])
+        visible = ((state & Chart.RETIRED) == 0) & (
+            (~playing & (0 < y) & (y < self.arrows_area.height))
+            | (playing & ~ended)
+            | (ended & (self.chart.opacity[window] > 0))
         )
 
-        for arrow in reversed(self.arrows):
-            arrow.render()
+        for i in np.flatnonzero(visible)[::-1]:
+            self.arrows[self.retire_index + i].render(int(y[i]))
 
-        self.arrows_area.game.window.screen.blit(
-            name_surface,
+        self.arrows_area.game.window.blit(
+            self.name_surface,
             (
                 self.arrows_area.game.window.screen.get_width() // 2
-                - name_surface.get_width() // 2,
+                - self.name_surface.get_width() // 2,
                 self.arrows_area.game.window.screen.get_height()
-                - name_surface.get_height()
+                - self.name_surface.get_height()
                 - 20,
             ),
         )
@@ -284,119 +438,97 @@ class Song:
 
 class Arrow:
 
-    SPEED = 5
-    PLAY_RANGE = 75
+    # Pixels per millisecond
+    SPEED = 0.3
     ENLARGE_SIZE = 20
+    GROW_TIME = 667
 
-    def __init__(self, song, notes):
+    def __init__(self, song, index, notes):
         self.song = song
+        self.chart = song.chart
+        self.index = index
         self.notes = notes
-        self.time = self.notes[0].time
-        self.duration = max(n.duration for n in self.notes)
-        self.finished = False
+        self.group = int(self.chart.lane[index])
         self.grow_center = None
 
-        self._opacity = 255
-
-        self.group = self.song.get_group_by_note(self.notes)
-
         self.target_pos = self.song.arrows_area.controls.controls_y
+        self.x = self.song.arrows_area.get_x_pos_by_group(self.group)
 
-        self.image = self.song.arrows_area.arrow_image_by_group(self.group)
-        self.image_copy = self.image.copy()
+    @property
+    def time(self):
+        return int(self.chart.time[self.index])
 
-        self.rect = self.image.get_rect()
-        self.rect.x = self.song.arrows_area.get_x_pos_by_group(self.group)
-        self.rect.y = self.target_pos + self.time * self.SPEED
+    @property
+    def duration(self):
+        return int(self.chart.duration[self.index])
 
-        self.playing = False
+    @property
+    def y(self):
+        return int(self.chart.y[self.index])
 
-    def is_playable(self):
-        return (
-            self.target_pos - self.PLAY_RANGE // 2
-            < self.rect.y
-            < self.target_pos + self.PLAY_RANGE // 2
-            and not self.playing
-        )
+    @property
+    def playing(self):
+        return bool(self.chart.state[self.index] & Chart.PLAYING)
 
     @property
-    def opacity(self):
-        return self._opacity
+    def finished(self):
+        return bool(self.chart.state[self.index] & Chart.FINISHED)
 
-    @opacity.setter
-    def opacity(self, val):
-        if val < 0:
-            val = 0
-        elif val > 255:
-            val = 255
+    @finished.setter
+    def finished(self, val):
+        if val:
+            self.chart.state[self.index] |= Chart.FINISHED
+        else:
+            self.chart.state[self.index] &= ~Chart.FINISHED
 
-        if self.opacity != val:
-            self.image = self.image_copy.copy()
-            self.image.fill((255, 255, 255, val), None, pygame.BLEND_RGBA_MULT)
+    @property
+    def retired(self):
+        return bool(self.chart.state[self.index] & Chart.RETIRED)
 
-        self._opacity = val
+    def is_playable(self, stamp):
+        return abs(stamp - self.time) <= Score.HIT_WINDOW and not self.playing
 
-    def update(self, frame):
-        if self.playing:
-            for n in self.notes:
-                n.update(self.song.song_frame)
-            if self.grow_center is None:
-                self.rect.y = self.target_pos
-            if all(n.finished for n in self.notes) and not self.finished:
-                self.song.arrows_area.controls.stop_glow(self.group)
-                self.finished = True
-        else:
-            self.rect.y -= self.SPEED
-            if (
-                self.rect.y < self.target_pos - self.PLAY_RANGE // 2
-                and not self.finished
-            ):
-                self.song.arrows_area.game.score.streak = 0
-                self.finished = True
-
-        if not self.finished:
-            if self.rect.y < 600 and self.opacity < 230:
-                self.opacity += 16
-            elif self.rect.y > 600:
-                self.opacity = 0
+    @property
+    def opacity(self):
+        return int(self.chart.opacity[self.index])
 
-    def render(self):
-        if (
-            not self.playing
-            and 0 < self.rect.y < self.song.arrows_area.height
-            or (self.playing and not self.song.song_frame > self.time + self.duration)
-        ):
-            self.song.arrows_area.image.blit(self.image, self.rect)
+    @opacity.setter
+    def opacity(self, val):
+        self.chart.opacity[self.index] = min(max(val, 0), 255)
+
+    def update(self, now):
+        for n in self.notes:
+            n.update(now)
+        if not self.finished and all(n.finished for n in self.notes):
+            self.song.arrows_area.controls.stop_glow(self.group)
+            self.finished = True
+
+    def render(self, y):
+        with profiler.span("Arrow.render"):
+            arrows_area = self.song.arrows_area
+            now = self.song.render_now
+            end = self.time + self.duration
+
+            if self.playing and now < end:
+                dist = (now - self.time) / max(min(self.GROW_TIME, self.duration), 1)
+                if not 0 <= dist <= 1:
+                    dist = 0
+                grow = int(self.ENLARGE_SIZE * math.sin(math.pi * dist))
+                image = arrows_area.arrow_grow_frames(self.group)[grow]
+                if self.grow_center is None:
+                    self.grow_center = (
+                        self.x + arrows_area.arrow_size[0] // 2,
+                        y + arrows_area.arrow_size[1] // 2,
+                    )
+                rect = image.get_rect(center=self.grow_center)
+            else:
+                self.grow_center = None
+                image = arrows_area.arrow_by_opacity(self.group, self.opacity)
+                rect = (self.x, y)
 
-        elif self.song.song_frame > self.time + self.duration and self.opacity > 0:
-            # fade out
-            self.opacity -= 25
-            self.song.arrows_area.image.blit(
-                self.image, self.rect  # , special_flags=pygame.BLEND_RGB_ADD
-            )
-        if self.playing and self.song.song_frame < self.time + self.duration:
-            dist = (self.song.song_frame - self.time) / min(40, self.duration)
-            if dist > 1:
-                dist = 0
-            self.image = pygame.transform.scale(
-                self.image_copy,
-                (
-                    int(
-                        self.song.arrows_area.arrow_size[0]
-                        + self.ENLARGE_SIZE * math.sin(math.pi * dist)
-                    ),
-                    int(
-                        self.song.arrows_area.arrow_size[1]
-                        + self.ENLARGE_SIZE * math.sin(math.pi * dist)
-                    ),
-                ),
-            )
-            if self.grow_center is None:
-                self.grow_center = self.rect.center
-            self.rect = self.image.get_rect(center=self.grow_center)
-        else:
-            self.grow_center = None
+            arrows_area.image.blit(image, rect)
 
     def play(self):
-        self.playing = True
+        self.chart.state[self.index] |= Chart.PLAYING
+        self.chart.y[self.index] = self.target_pos
         self.song.arrows_area.controls.glow(self.group)
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .midi import MidiFile, NoteScheduler
+
+
+def no_progress(fraction, status):
+    pass
+
+
+@contextmanager
+def atomic_path(path):
+    # Yields a temporary file next to path, which replaces path once written.
+    # Readers, even in other processes, never see a half written file.
+    tmp = Path(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield tmp
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+
+
+class Chart:
+
+    # Arrow state flags
+    PLAYING = 1
+    FINISHED = 2
+    RETIRED = 4
+
+    LANES = 4
+
+    def __init__(self, time, lane, duration):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.lane = np.asarray(lane, dtype=np.int8)
+        self.duration = np.asarray(duration, dtype=np.int64)
+
+        self.state = np.zeros(len(self.time), dtype=np.uint8)
+        self.opacity = np.full(len(self.time), 255, dtype=np.int16)
+        self.y = np.zeros(len(self.time), dtype=np.int64)
+
+        # Row indices of each lane's arrows, already in time order
+        self.lanes = [np.flatnonzero(self.lane == g) for g in range(self.LANES)]
+
+    def __len__(self):
+        return len(self.time)
+
+    def reset(self, target, speed):
+        self.state[:] = 0
+        self.opacity[:] = 255
+        self.y[:] = target + self.time * speed
+
+    def window(self, now, lookahead):
+        return int(np.searchsorted(self.time, now + lookahead, side="right"))
+
+
+class CompiledChart:
+
+    # Bump whenever the compiled layout or the timing it bakes in changes
+    VERSION = 2
+    MAGIC = b"MARCHART"
+    INTRO = 3
+
+    ARRAYS = (
+        "programs",
+        "arrow_time",
+        "arrow_lane",
+        "arrow_duration",
+        "arrow_offsets",
+        "note_time",
+        "note_pitch",
+        "note_duration",
+        "note_velocity",
+        "note_channel",
+        "backing_time",
+        "backing_events",
+    )
+
+    def __init__(self, meta, **arrays):
+        self.meta = meta
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def name(self):
+        return self.meta.get("name", "Unknown")
+
+    @property
+    def artist(self):
+        return self.meta.get("artist", "Unknown")
+
+    @property
+    def duration(self):
+        # Song length in seconds, not counting the intro
+        ends = [0]
+        if len(self.backing_time):
+            ends.append(int(self.backing_time[-1]))
+        if len(self.note_time):
+            ends.append(int((self.note_time + self.note_duration).max()))
+        return max(max(ends) / 1000 - self.INTRO, 0)
+
+    @property
+    def note_count(self):
+        return len(self.note_time)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    @classmethod
+    def parse(cls, song_file, song_data):
+        midi = MidiFile(
+            Path(song_file).parent / song_data["midi"],
+            tempo=song_data.get("tempo", 1),
+        )
+        midi.intro(cls.INTRO)
+        return midi
+
+    @classmethod
+    def compile(
+        cls, song_file, difficulty=0, song_data=None, progress=no_progress, midi=None
+    ):
+        song_file = Path(song_file)
+        if song_data is None:
+            with song_file.open() as f:
+                song_data = json.load(f)
+
+        if midi is None:
+            progress(0.1, "Parsing MIDI")
+            midi = cls.parse(song_file, song_data)
+
+        progress(0.7, "Building chart")
+        playing_instruments = midi.get_instruments_by_index(
+            *song_data["levels"][difficulty]
+        )
+
+        backing = NoteScheduler.from_notes(
+            n
+            for instrument, notes in midi.notes.items()
+            if instrument not in playing_instruments
+            for n in notes
+        )
+
+        arrow_notes = [
+            n
+            for instrument, notes in midi.notes.items()
+            for n in notes
+            if instrument in playing_instruments
+        ]
+        frequencies = sorted(n.note for n in arrow_notes)
+
+        # Notes struck within the same 60th of a second become one arrow
+        arrow_notes_by_time = defaultdict(list)
+        for note in sorted(arrow_notes, key=lambda n: n.time):
+            arrow_notes_by_time[note.time * 60 // 1000].append(note)
+        groups = [notes for _, notes in sorted(arrow_notes_by_time.items())]
+        notes = [n for group in groups for n in group]
+
+        return cls(
+            {
+                "name": song_data.get("name", "Unknown"),
+                "artist": song_data.get("artist", "Unknown"),
+                "difficulty": difficulty,
+            },
+            programs=np.array(midi.get_programs(), dtype=np.uint8).reshape(-1, 2),
+            arrow_time=np.array([g[0].time for g in groups], dtype=np.int64),
+            arrow_lane=np.array(
+                [lane_by_notes(g, frequencies) for g in groups], dtype=np.int8
+            ),
+            arrow_duration=np.array(
+                [max(n.duration for n in g) for g in groups], dtype=np.int64
+            ),
+            arrow_offsets=np.cumsum([0] + [len(g) for g in groups], dtype=np.int64),
+            note_time=np.array([n.time for n in notes], dtype=np.int64),
+            note_pitch=np.array([n.note for n in notes], dtype=np.uint8),
+            note_duration=np.array([n.duration for n in notes], dtype=np.int64),
+            note_velocity=np.array([n.velocity for n in notes], dtype=np.uint8),
+            note_channel=np.array([n.channel for n in notes], dtype=np.uint8),
+            backing_time=backing.times,
+            backing_events=backing.events,
+        )
+
+    def save(self, path):
+        header = {"meta": self.meta, "arrays": {}}
+        offset = 0
+        arrays = []
+        for name in self.ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            header["arrays"][name] = {
+                "dtype": array.dtype.str,
+                "shape": array.shape,
+                "offset": offset,
+            }
+            arrays.append(array)
+            # Keep every array 16-byte aligned within the data section
+            offset += -(-array.nbytes // 16) * 16
+
+        header_bytes = json.dumps(header).encode()
+        header_bytes += b" " * (-(len(self.MAGIC) + 4 + len(header_bytes)) % 16)
+
+        with atomic_path(path) as tmp, tmp.open("wb") as f:
+            f.write(self.MAGIC)
+            f.write(len(header_bytes).to_bytes(4, "little"))
+            f.write(header_bytes)
+            for array in arrays:
+                f.write(array.tobytes())
+                f.write(b"\0" * (-array.nbytes % 16))
+
+    @classmethod
+    def load(cls, path):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(data[: len(cls.MAGIC)]) != cls.MAGIC:
+            raise ValueError(f"{path} is not a compiled chart")
+
+        start = len(cls.MAGIC) + 4
+        header_size = int.from_bytes(bytes(data[len(cls.MAGIC) : start]), "little")
+        header = json.loads(bytes(data[start : start + header_size]))
+        base = start + header_size
+
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            begin = base + spec["offset"]
+            arrays[name] = (
+                data[begin : begin + count * dtype.itemsize]
+                .view(dtype)
+                .reshape(spec["shape"])
+            )
+        return cls(header["meta"], **arrays)
+
+
+def lane_by_notes(notes, frequencies):
+    step = (len(frequencies) - 1) // 4
+    group = 0
+    avg_note = sum(n.note for n in notes) / len(notes)
+    for i in range(step, step * 3 + 1, step):
+        if avg_note > frequencies[i]:
+            group += 1
+        else:
+            break
+    return group
+
+
+class ChartCache:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def key(self, song_file, song_data, difficulty):
+        digest = hashlib.sha1()
+        digest.update(f"v{CompiledChart.VERSION}\0".encode())
+        digest.update((Path(song_file).parent / song_data["midi"]).read_bytes())
+        # Everything compile reads from the song, including the name and
+        # artist that are stored in the chart's metadata
+        digest.update(
+            json.dumps(
+                [
+                    song_data.get("tempo", 1),
+                    song_data["levels"],
+                    difficulty,
+                    song_data.get("name", "Unknown"),
+                    song_data.get("artist", "Unknown"),
+                ]
+            ).encode()
+        )
+        return digest.hexdigest()
+
+    def path(self, song_file, difficulty, key):
+        return self.directory / f"{Path(song_file).stem}-{difficulty}-{key}.chart"
+
+    def load(self, song_file, difficulty=0, progress=no_progress):
+        song_file = Path(song_file)
+        progress(0.05, "Reading song")
+        with song_file.open() as f:
+            song_data = json.load(f)
+
+        path = self.path(
+            song_file, difficulty, self.key(song_file, song_data, difficulty)
+        )
+        if path.exists():
+            progress(0.9, "Loading chart")
+            try:
+                return CompiledChart.load(path)
+            except (ValueError, KeyError, OSError):
+                pass
+
+        compiled = CompiledChart.compile(song_file, difficulty, song_data, progress)
+        progress(0.95, "Caching chart")
+        try:
+            self.store(song_file, difficulty, path, compiled)
+        except OSError:
+            # A read-only cache only costs us the parse next time
+            pass
+        return compiled
+
+    def build(self, song_file, force=False):
+        # Compile every difficulty of a song, parsing the MIDI at most once.
+        # Returns the difficulties that had to be compiled.
+        song_file = Path(song_file)
+        with song_file.open() as f:
+            song_data = json.load(f)
+
+        midi = None
+        built = []
+        for difficulty in range(len(song_data["levels"])):
+            path = self.path(
+                song_file, difficulty, self.key(song_file, song_data, difficulty)
+            )
+            if path.exists() and not force:
+                continue
+            if midi is None:
+                midi = CompiledChart.parse(song_file, song_data)
+            compiled = CompiledChart.compile(
+                song_file, difficulty, song_data, midi=midi
+            )
+            self.store(song_file, difficulty, path, compiled)
+            built.append(difficulty)
+        return built
+
+    def store(self, song_file, difficulty, path, compiled):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Any other build of this song and difficulty is now stale
+        for stale in self.directory.glob(
+            self.path(song_file, difficulty, "?" * 40).name
+        ):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+        compiled.save(path)
+
+
+def compile_song(cache_dir, song_file, force=False):
+    # Builds every chart of a song into the cache, meant to be run in a worker
+    # process. Returns the difficulties compiled and how long that took.
+    start = time.perf_counter()
+    built = ChartCache(cache_dir).build(song_file, force)
+    return built, time.perf_counter() - start
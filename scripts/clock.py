@@ -0,0 +1,31 @@
+import time
+
+
+class SongClock:
+    def __init__(self, source=time.perf_counter):
+        # source returns monotonic seconds, anything else can be swapped in
+        # to drive a song faster or slower than real time
+        self.source = source
+        self.start_time = None
+
+    @property
+    def running(self):
+        return self.start_time is not None
+
+    def start(self):
+        self.start_time = self.source()
+
+    def stop(self):
+        self.start_time = None
+
+    def now(self):
+        # Milliseconds since the song started
+        if self.start_time is None:
+            return 0
+        return int((self.source() - self.start_time) * 1000)
+
+    def sync(self, position):
+        # Nudges the clock towards position, in milliseconds, so that it
+        # follows another clock such as the audio device's without jumping
+        if self.start_time is not None:
+            self.start_time += (self.now() - position) / 1000 * 0.1
@@ -0,0 +1,25 @@
+import string
+
+CHARACTERS = string.ascii_letters + string.digits + string.punctuation + " "
+
+
+class Glyphs:
+    # Every character of a font rendered once up front, for drawing text
+    # that changes too often to render whole
+
+    def __init__(self, font, colour, antialias=True):
+        self.surfaces = {c: font.render(c, antialias, colour) for c in CHARACTERS}
+        self.height = font.get_height()
+
+    def width(self, text):
+        width = 0
+        for c in text:
+            width += self.surfaces[c].get_width()
+        return width
+
+    def render_to(self, surface, text, dest):
+        x, y = dest
+        for c in text:
+            glyph = self.surfaces[c]
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
@@ -3,26 +3,62 @@ import sys
 import pygame
 from pygame.locals import *
 
+from .midi import close_player
+from .profiler import profiler
+
 
 class InputManager:
+
+    LANE_KEYS = {
+        K_a: 0,
+        K_LEFT: 0,
+        K_w: 1,
+        K_UP: 1,
+        K_s: 2,
+        K_DOWN: 2,
+        K_d: 3,
+        K_RIGHT: 3,
+    }
+
     def __init__(self, game):
         self.game = game
-        self.arrows = []
+        self.events = []
 
-    def process_inputs(self):
+    def collect(self):
+        # Events are stamped with the song time as soon as they are pulled,
+        # the game loop calls this while it waits between frames too
+        stamp = self.game.song_clock.now()
         for event in pygame.event.get():
+            self.events.append((event, stamp))
+
+    def process_inputs(self):
+        self.collect()
+        events, self.events = self.events, []
+        for event, stamp in events:
 
             # Quit
             if event.type == QUIT:
+                self.game.sequencer.stop()
+                close_player()
+                self.game.prefetcher.shutdown()
                 pygame.quit()
                 sys.exit()
 
+            # Profiler hotkeys work on every screen
+            elif event.type == KEYDOWN and event.key == K_F3:
+                profiler.toggle()
+                self.game.window.invalidate()
+            elif event.type == KEYDOWN and event.key == K_F4:
+                profiler.export(self.game.data / "profiles")
+
             elif self.game.screen == "game":
-                self.process_game_inputs(event)
+                self.process_game_inputs(event, stamp)
             elif self.game.screen == "menu":
                 self.process_menu_inputs(event)
             elif self.game.screen == "list":
                 self.process_list_inputs(event)
+            elif self.game.screen == "loading":
+                self.process_loading_inputs(event)
 
     def process_menu_inputs(self, event):
         if event.type == KEYDOWN:
@@ -44,54 +80,31 @@ class InputManager:
                 self.game.level_list.back()
                 pygame.mixer.Sound.play(self.game.click)
 
-    def process_game_inputs(self, event):
+    def process_loading_inputs(self, event):
+        if event.type == KEYDOWN and event.key == K_ESCAPE:
+            self.game.loading.cancel()
+            self.game.screen = "list"
+            pygame.mixer.Sound.play(self.game.click)
+
+    def process_game_inputs(self, event, stamp):
         if event.type == KEYDOWN:
-            self.arrows = self.game.arrows_area.song.get_playable_arrows()
-            if not self.arrows:
-                self.game.score.value -= 100
             if event.key == K_ESCAPE:
                 self.game.screen = "list"
                 self.game.arrows_area.reset()
+                self.game.collect_garbage()
                 pygame.mixer.Sound.play(self.game.click)
-            elif event.key == K_a or event.key == K_LEFT:
-                if self.arrows:
-                    self.play_arrow_for_group(0)
-                    self.game.score.value += 25
-                self.game.arrows_area.controls.glow(0)
-            elif event.key == K_w or event.key == K_UP:
-                if self.arrows:
-                    self.play_arrow_for_group(1)
-                    self.game.score.value += 25
-
-                self.game.arrows_area.controls.glow(1)
-            elif event.key == K_s or event.key == K_DOWN:
-                if self.arrows:
-                    self.play_arrow_for_group(2)
-                    self.game.score.value += 25
-                self.game.arrows_area.controls.glow(2)
-            elif event.key == K_d or event.key == K_RIGHT:
-                if self.arrows:
-                    self.play_arrow_for_group(3)
-                    self.game.score.value += 25
-                self.game.arrows_area.controls.glow(3)
+            elif event.key in self.LANE_KEYS:
+                self.play_arrow_for_group(self.LANE_KEYS[event.key], stamp)
         elif event.type == KEYUP:
-            if event.key == K_a or event.key == K_LEFT:
-                self.game.arrows_area.controls.stop_glow(0)
-            elif event.key == K_w or event.key == K_UP:
-                self.game.arrows_area.controls.stop_glow(1)
-            elif event.key == K_s or event.key == K_DOWN:
-                self.game.arrows_area.controls.stop_glow(2)
-            elif event.key == K_d or event.key == K_RIGHT:
-                self.game.arrows_area.controls.stop_glow(3)
-
-    def play_arrow_for_group(self, n):
-        played = False
-        for a in self.arrows:
-            if a.group == n:
-                a.play()
-                self.game.score.streak += 1
-                played = True
-                break
-        if not played:
-            self.game.score.streak = 0
-        return played
+            if event.key in self.LANE_KEYS:
+                self.game.arrows_area.controls.stop_glow(self.LANE_KEYS[event.key])
+
+    def play_arrow_for_group(self, n, stamp):
+        arrow = self.game.arrows_area.song.get_playable_arrow(n, stamp)
+        if arrow is not None:
+            arrow.play()
+            self.game.score.hit(stamp - arrow.time)
+        else:
+            self.game.score.miss(self.game.score.MISS_PENALTY)
+        self.game.arrows_area.controls.glow(n)
+        return arrow is not None
@@ -1,5 +1,6 @@
 import pygame
-import json
+
+from .library import Library
 
 
 class LevelList:
@@ -7,8 +8,8 @@ class LevelList:
         self.game = game
 
         self.width, self.height = self.game.window.WINDOW_SIZE
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        self.image.set_colorkey((0, 0, 0))
+        # The list covers the whole window, so an opaque surface blits fastest
+        self.image = pygame.Surface((self.width, self.height))
         self.rect = self.image.get_rect()
 
         self.selected_song = 0
@@ -16,25 +17,35 @@ class LevelList:
 
         self.margin_x, self.margin_y = 100, 50
 
-        self.title_font = pygame.font.Font(
-            self.game.data / "fonts" / "Oswald-Regular.ttf", 40
+        self.title_font = self.game.load_font("Oswald-Regular.ttf", 40)
+        self.title_surface = self.game.render_text(
+            self.title_font, "LEVEL LIST", True, (255, 255, 255)
         )
-        self.title_surface = self.title_font.render("LEVEL LIST", True, (255, 255, 255))
-
-        self.info_screen = InfoScreen(self)
 
-        self.levels = []
+        # Only the rows inside the viewport are ever built or drawn
+        self.row_height = 60
+        self.list_y = self.margin_y + self.title_surface.get_height() + 20
+        self.visible_rows = (
+            self.height - self.list_y - self.margin_y + 10
+        ) // self.row_height
+        self.scroll = 0
+        self.buttons = {}
+        self.dirty = True
 
-        self.song_paths = list((self.game.data / "songs").glob("*.json"))
+        self.info_screen = InfoScreen(self)
 
-        for json_file in self.song_paths:
-            with json_file.open() as f:
-                self.levels.append(json.load(f))
+        self.library = Library(
+            self.game.data / "songs", self.game.data / "cache" / "library.sqlite"
+        )
+        self.library.refresh()
+        self.levels = self.library.songs()
+        self.song_paths = [level["path"] for level in self.levels]
 
     def move_up(self):
         if not self.song_selected:
             if self.selected_song > 0:
                 self.selected_song -= 1
+                self.scroll_to_selection()
         else:
             if self.info_screen.selected_difficulty > 0:
                 self.info_screen.selected_difficulty -= 1
@@ -43,13 +54,21 @@ class LevelList:
         if not self.song_selected:
             if self.selected_song < len(self.levels) - 1:
                 self.selected_song += 1
+                self.scroll_to_selection()
         else:
             if (
                 self.info_screen.selected_difficulty
-                < len(self.levels[self.selected_song]["levels"]) - 1
+                < self.levels[self.selected_song]["level_count"] - 1
             ):
                 self.info_screen.selected_difficulty += 1
 
+    def scroll_to_selection(self):
+        if self.selected_song < self.scroll:
+            self.scroll = self.selected_song
+        elif self.selected_song >= self.scroll + self.visible_rows:
+            self.scroll = self.selected_song - self.visible_rows + 1
+        self.dirty = True
+
     def select(self):
         if not self.song_selected:
             self.song_selected = True
@@ -68,9 +87,21 @@ class LevelList:
             self.game.screen = "menu"
 
     def update(self, frame):
-        pass
+        if self.levels:
+            self.game.prefetcher.prefetch(
+                self.song_paths[self.selected_song],
+                range(self.levels[self.selected_song]["level_count"]),
+            )
+            self.info_screen.update()
 
     def render(self):
+        changed = self.dirty or self.info_screen.dirty
+        if changed:
+            self.compose()
+
+        self.game.window.blit(self.image, self.rect, changed=changed, opaque=True)
+
+    def compose(self):
         self.image.fill((0, 0, 0))
 
         self.image.blit(
@@ -81,33 +112,46 @@ class LevelList:
             ),
         )
 
-        for i, level in enumerate(self.levels):
-            btn = LevelButton(self, level)
-            if i == self.selected_song:
-                btn.selected = True
-            btn_surface = btn.render()
+        first = self.scroll
+        last = min(self.scroll + self.visible_rows, len(self.levels))
+        for i in [i for i in self.buttons if not first <= i < last]:
+            del self.buttons[i]
+
+        for i in range(first, last):
+            if i not in self.buttons:
+                self.buttons[i] = LevelButton(self, self.levels[i])
+            btn = self.buttons[i]
+            btn.selected = i == self.selected_song
             self.image.blit(
-                btn_surface,
-                (
-                    self.margin_x,
-                    self.margin_y
-                    + self.title_surface.get_height()
-                    + 20
-                    + i * (btn_surface.get_height() + 10),
-                ),
+                btn.render(),
+                (self.margin_x, self.list_y + (i - first) * self.row_height),
+            )
+
+        if len(self.levels) > self.visible_rows:
+            track_height = self.visible_rows * self.row_height - 10
+            thumb = pygame.Rect(
+                self.margin_x + self.buttons[first].image.get_width() + 8,
+                0,
+                4,
+                max(track_height * self.visible_rows // len(self.levels), 20),
+            )
+            thumb.y = self.list_y + (track_height - thumb.height) * self.scroll // (
+                len(self.levels) - self.visible_rows
             )
+            pygame.draw.rect(self.image, (80, 80, 80), thumb)
 
-        self.info_screen.update()
-        self.info_screen.render()
+        if self.levels:
+            self.info_screen.render()
 
-        self.game.window.screen.blit(self.image, self.rect)
+        self.dirty = False
 
 
 class LevelButton:
     def __init__(self, level_list, level):
         self.level_list = level_list
         self.level = level
-        self.selected = False
+        self._selected = False
+        self.dirty = True
         self.image = pygame.Surface(
             (
                 (self.level_list.image.get_width() - self.level_list.margin_x * 2)
@@ -119,20 +163,32 @@ class LevelButton:
         self.image.set_colorkey((0, 0, 0))
         self.rect = self.image.get_rect()
 
-        self.title_font = pygame.font.Font(
-            self.level_list.game.data / "fonts" / "Oswald-Regular.ttf", 20
-        )
+        self.title_font = self.level_list.game.load_font("Oswald-Regular.ttf", 20)
+
+    @property
+    def selected(self):
+        return self._selected
+
+    @selected.setter
+    def selected(self, val):
+        if val != self._selected:
+            self._selected = val
+            self.dirty = True
 
     def update(self):
         pass
 
     def render(self):
+        if not self.dirty:
+            return self.image
+
         if self.selected:
             self.image.fill(self.level_list.game.accent_colour)
         else:
             self.image.fill((26, 26, 26))
 
-        title_surface = self.title_font.render(
+        title_surface = self.level_list.game.render_text(
+            self.title_font,
             self.level.get("artist", "Unknown")
             + " - "
             + self.level.get("name", "Unknown"),
@@ -147,6 +203,7 @@ class LevelButton:
             ),
         )
 
+        self.dirty = False
         return self.image
 
 
@@ -156,7 +213,11 @@ class InfoScreen:
         self.margin_x = 25
         self.margin_y = 25
 
-        self.selected_difficulty = None
+        self._selected_difficulty = None
+        self.song = None
+        self.shown_details = None
+        self.buttons = []
+        self.dirty = True
 
         self.difficulties = [
             "Easy",
@@ -182,16 +243,14 @@ class InfoScreen:
             pygame.SRCALPHA,
         )
 
-        self.song_font = pygame.font.Font(
-            self.level_list.game.data / "fonts" / "Oswald-Regular.ttf", 25
-        )
-        self.artist_font = pygame.font.Font(
-            self.level_list.game.data / "fonts" / "Oswald-Regular.ttf", 15
-        )
-        self.section_header_font = pygame.font.Font(
-            self.level_list.game.data / "fonts" / "Oswald-Regular.ttf", 15
+        self.song_font = self.level_list.game.load_font("Oswald-Regular.ttf", 25)
+        self.artist_font = self.level_list.game.load_font("Oswald-Regular.ttf", 15)
+        self.section_header_font = self.level_list.game.load_font(
+            "Oswald-Regular.ttf", 15
         )
 
+        self.details = {}
+
         self.rect = self.image.get_rect()
         self.rect.x = (
             self.level_list.image.get_width() - self.level_list.margin_x * 2
@@ -200,13 +259,60 @@ class InfoScreen:
             self.level_list.margin_y + self.level_list.title_surface.get_height() + 20
         )
 
+    @property
+    def selected_difficulty(self):
+        return self._selected_difficulty
+
+    @selected_difficulty.setter
+    def selected_difficulty(self, val):
+        self._selected_difficulty = val
+        self.dirty = True
+
     def update(self):
-        pass
+        if self.song != self.level_list.selected_song:
+            self.song = self.level_list.selected_song
+            self.buttons = []
+            self.dirty = True
+
+        if self.get_details() is not self.shown_details:
+            self.dirty = True
+
+    def get_details(self):
+        # Song length and note counts need the MIDI, so they are only worked
+        # out once the prefetcher has compiled the song being shown
+        path = self.level_list.song_paths[self.level_list.selected_song]
+        if path not in self.details:
+            self.details[path] = self.level_list.library.details(path)
+
+        if self.details[path] is None:
+            charts = [
+                self.level_list.game.prefetcher.get(path, difficulty)
+                for difficulty in range(
+                    self.level_list.levels[self.level_list.selected_song]["level_count"]
+                )
+            ]
+            if all(charts):
+                self.level_list.library.set_details(
+                    path,
+                    max(chart.duration for chart in charts),
+                    [chart.note_count for chart in charts],
+                )
+                self.details[path] = self.level_list.library.details(path)
+
+        return self.details[path]
 
     def render(self):
+        if self.dirty:
+            self.compose()
+        self.level_list.image.blit(self.image, self.rect)
+
+    def compose(self):
         self.image.fill((255, 255, 255))
 
-        artist_surface = self.artist_font.render(
+        details = self.shown_details = self.get_details()
+
+        artist_surface = self.level_list.game.render_text(
+            self.artist_font,
             self.level_list.levels[self.level_list.selected_song].get(
                 "artist", "Unknown"
             ),
@@ -214,7 +320,8 @@ class InfoScreen:
             (0, 0, 0),
         )
 
-        song_surface = self.song_font.render(
+        song_surface = self.level_list.game.render_text(
+            self.song_font,
             self.level_list.levels[self.level_list.selected_song].get(
                 "name", "Unknown"
             ),
@@ -222,8 +329,8 @@ class InfoScreen:
             (0, 0, 0),
         )
 
-        section_header_surface = self.section_header_font.render(
-            "DIFFICULTY LEVELS", True, (0, 0, 0)
+        section_header_surface = self.level_list.game.render_text(
+            self.section_header_font, "DIFFICULTY LEVELS", True, (0, 0, 0)
         )
 
         self.image.blit(
@@ -242,6 +349,21 @@ class InfoScreen:
             ),
         )
 
+        if details is not None:
+            minutes, seconds = divmod(int(details["duration"]), 60)
+            details_surface = self.level_list.game.render_text(
+                self.artist_font, f"{minutes}:{seconds:02d}", True, (120, 120, 120)
+            )
+            self.image.blit(
+                details_surface,
+                (
+                    self.margin_x,
+                    self.margin_y
+                    + artist_surface.get_height()
+                    + song_surface.get_height(),
+                ),
+            )
+
         self.image.blit(
             section_header_surface,
             (
@@ -253,15 +375,18 @@ class InfoScreen:
             ),
         )
 
-        for i, (level, difficulty) in enumerate(
-            zip(
-                self.level_list.levels[self.level_list.selected_song]["levels"],
-                self.difficulties,
-            )
-        ):
-            btn = DifficultyButton(self, i)
-            if i == self.selected_difficulty:
-                btn.selected = True
+        if not self.buttons:
+            level_count = self.level_list.levels[self.level_list.selected_song][
+                "level_count"
+            ]
+            self.buttons = [
+                DifficultyButton(self, i)
+                for i in range(min(level_count, len(self.difficulties)))
+            ]
+
+        for i, btn in enumerate(self.buttons):
+            btn.selected = i == self.selected_difficulty
+            btn.notes = details["note_counts"][i] if details else None
             btn_surface = btn.render()
             self.image.blit(
                 btn_surface,
@@ -276,14 +401,16 @@ class InfoScreen:
                 ),
             )
 
-        self.level_list.image.blit(self.image, self.rect)
+        self.dirty = False
 
 
 class DifficultyButton:
-    def __init__(self, info_screen, level):
+    def __init__(self, info_screen, level, notes=None):
         self.info_screen = info_screen
         self.level = level
-        self.selected = False
+        self._notes = notes
+        self._selected = False
+        self.dirty = True
         self.image = pygame.Surface(
             (
                 (self.info_screen.image.get_width() - self.info_screen.margin_x * 2),
@@ -294,20 +421,44 @@ class DifficultyButton:
         self.image.set_colorkey((0, 0, 0))
         self.rect = self.image.get_rect()
 
-        self.title_font = pygame.font.Font(
-            self.info_screen.level_list.game.data / "fonts" / "Oswald-Regular.ttf", 15
+        self.title_font = self.info_screen.level_list.game.load_font(
+            "Oswald-Regular.ttf", 15
         )
 
+    @property
+    def selected(self):
+        return self._selected
+
+    @selected.setter
+    def selected(self, val):
+        if val != self._selected:
+            self._selected = val
+            self.dirty = True
+
+    @property
+    def notes(self):
+        return self._notes
+
+    @notes.setter
+    def notes(self, val):
+        if val != self._notes:
+            self._notes = val
+            self.dirty = True
+
     def update(self):
         pass
 
     def render(self):
+        if not self.dirty:
+            return self.image
+
         if self.selected:
             self.image.fill(self.info_screen.level_list.game.accent_colour)
         else:
             self.image.fill((230, 230, 230))
 
-        title_surface = self.title_font.render(
+        title_surface = self.info_screen.level_list.game.render_text(
+            self.title_font,
             self.info_screen.difficulties[self.level],
             True,
             (255, 255, 255) if self.selected else (1, 1, 1),
@@ -320,4 +471,20 @@ class DifficultyButton:
             ),
         )
 
-        return self.image
\ No newline at end of file
+        if self.notes is not None:
+            notes_surface = self.info_screen.level_list.game.render_text(
+                self.title_font,
+                f"{self.notes} NOTES",
+                True,
+                (255, 255, 255) if self.selected else (1, 1, 1),
+            )
+            self.image.blit(
+                notes_surface,
+                (
+                    self.image.get_width() - notes_surface.get_width() - 15,
+                    self.image.get_height() // 2 - notes_surface.get_height() // 2,
+                ),
+            )
+
+        self.dirty = False
+        return self.image
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+
+class Library:
+
+    # Bump whenever the schema changes, the index is then rebuilt from scratch
+    VERSION = 2
+
+    def __init__(self, songs_dir, index_file):
+        self.songs_dir = Path(songs_dir)
+        self.index_file = Path(index_file)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+
+        self.db = sqlite3.connect(self.index_file)
+        self.db.row_factory = sqlite3.Row
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.db.executescript(f"""
+                DROP TABLE IF EXISTS songs;
+                CREATE TABLE songs (
+                    path TEXT PRIMARY KEY,
+                    json_mtime INTEGER NOT NULL,
+                    midi TEXT NOT NULL,
+                    midi_mtime INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    artist TEXT NOT NULL,
+                    level_count INTEGER NOT NULL,
+                    duration REAL,
+                    note_counts TEXT
+                );
+                PRAGMA user_version = {self.VERSION};
+                """)
+
+    def refresh(self):
+        indexed = {
+            row["path"]: row
+            for row in self.db.execute(
+                "SELECT path, json_mtime, midi, midi_mtime FROM songs"
+            )
+        }
+
+        seen = set()
+        with self.db:
+            for entry in os.scandir(self.songs_dir):
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                path = entry.path
+                seen.add(path)
+
+                json_mtime = entry.stat().st_mtime_ns
+                row = indexed.get(path)
+                if row is not None and row["json_mtime"] == json_mtime:
+                    # The JSON is unchanged, only the MIDI details can be stale
+                    midi_mtime = self.midi_mtime(path, row["midi"])
+                    if midi_mtime != row["midi_mtime"]:
+                        self.db.execute(
+                            "UPDATE songs SET midi_mtime = ?, duration = NULL,"
+                            " note_counts = NULL WHERE path = ?",
+                            (midi_mtime, path),
+                        )
+                    continue
+
+                try:
+                    with open(path) as f:
+                        song_data = json.load(f)
+                    level_count = len(song_data["levels"])
+                    midi = song_data["midi"]
+                except (OSError, ValueError, KeyError):
+                    seen.discard(path)
+                    continue
+
+                self.db.execute(
+                    "INSERT OR REPLACE INTO songs (path, json_mtime, midi, midi_mtime,"
+                    " name, artist, level_count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        json_mtime,
+                        midi,
+                        self.midi_mtime(path, midi),
+                        song_data.get("name", "Unknown"),
+                        song_data.get("artist", "Unknown"),
+                        level_count,
+                    ),
+                )
+
+            for path in indexed.keys() - seen:
+                self.db.execute("DELETE FROM songs WHERE path = ?", (path,))
+
+    def midi_mtime(self, path, midi):
+        try:
+            return os.stat(os.path.join(os.path.dirname(path), midi)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def songs(self):
+        return [
+            {
+                "path": row["path"],
+                "name": row["name"],
+                "artist": row["artist"],
+                "level_count": row["level_count"],
+            }
+            for row in self.db.execute(
+                "SELECT path, name, artist, level_count FROM songs ORDER BY path"
+            )
+        ]
+
+    def details(self, path):
+        row = self.db.execute(
+            "SELECT duration, note_counts FROM songs WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is None or row["duration"] is None:
+            return None
+        return {
+            "duration": row["duration"],
+            "note_counts": json.loads(row["note_counts"]),
+        }
+
+    def set_details(self, path, duration, note_counts):
+        with self.db:
+            self.db.execute(
+                "UPDATE songs SET duration = ?, note_counts = ? WHERE path = ?",
+                (duration, json.dumps(note_counts), str(path)),
+            )
@@ -0,0 +1,171 @@
+import sys
+import threading
+
+import pygame
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class SongLoader:
+    def __init__(self, charts, song_file, difficulty, backing_tracks=None):
+        self.charts = charts
+        self.backing_tracks = backing_tracks
+        self.song_file = song_file
+        self.difficulty = difficulty
+
+        self.progress = 0
+        self.status = "Starting"
+        self.result = None
+        self.error = None
+
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def run(self):
+        try:
+            if self.backing_tracks is None:
+                self.result = self.charts.load(
+                    self.song_file, self.difficulty, self.report
+                )
+            else:
+                # The chart and the backing track get half of the bar each
+                result = self.charts.load(
+                    self.song_file,
+                    self.difficulty,
+                    lambda progress, status: self.report(progress / 2, status),
+                )
+                self.backing_tracks.load(
+                    result,
+                    lambda progress, status: self.report(0.5 + progress / 2, status),
+                )
+                self.result = result
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+
+    def report(self, progress, status):
+        if self.cancelled.is_set():
+            raise LoadCancelled
+        self.progress = progress
+        self.status = status
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class Loading:
+
+    # How long a failed load is shown before going back to the list
+    ERROR_FRAMES = 180
+
+    def __init__(self, game):
+        self.game = game
+        self.loader = None
+        self.progress = 0
+        self.error = None
+        self.error_frames = 0
+
+        self.width, self.height = self.game.window.WINDOW_SIZE
+        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.image.set_colorkey((0, 0, 0))
+        self.rect = self.image.get_rect()
+
+        self.bar_width, self.bar_height = 400, 6
+
+        self.title_font = self.game.load_font("Oswald-Regular.ttf", 40)
+        self.status_font = self.game.load_font("Oswald-Regular.ttf", 16)
+
+    def start(self, song_file, difficulty):
+        self.progress = 0
+        self.error = None
+        self.loader = SongLoader(
+            self.game.charts, song_file, difficulty, self.game.backing_tracks
+        )
+
+    def cancel(self):
+        self.error = None
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+
+    def update(self, frame):
+        if self.error is not None:
+            self.error_frames -= 1
+            if self.error_frames <= 0:
+                self.error = None
+                self.game.screen = "list"
+            return
+
+        if self.loader is None:
+            return
+
+        # Ease the bar towards the worker's progress so it never jumps
+        self.progress += (self.loader.progress - self.progress) * 0.2
+
+        if self.loader.done:
+            loader, self.loader = self.loader, None
+            if loader.error is not None:
+                # A broken song is reported, it doesn't take the game down
+                print(
+                    f"Could not load {loader.song_file}: {loader.error!r}",
+                    file=sys.stderr,
+                )
+                self.error = loader.error
+                self.error_frames = self.ERROR_FRAMES
+                return
+            if loader.result is not None:
+                self.game.start_song(loader.result)
+
+    def render(self):
+        self.image.fill((0, 0, 0))
+
+        if self.error is not None:
+            title = "COULD NOT LOAD SONG"
+            status = f"{type(self.error).__name__}: {self.error}"[:80]
+            status += "  |  Press Escape to go back"
+        else:
+            title = "LOADING"
+            status = (self.loader.status if self.loader else "Starting").upper()
+            status += "  |  Press Escape to cancel"
+
+        title_surface = self.game.render_text(
+            self.title_font, title, True, (255, 255, 255)
+        )
+        status_surface = self.game.render_text(
+            self.status_font, status, True, self.game.accent_colour
+        )
+
+        title_rect = self.image.blit(
+            title_surface,
+            (
+                self.width // 2 - title_surface.get_width() // 2,
+                self.height // 2 - title_surface.get_height() - 10,
+            ),
+        )
+
+        bar = pygame.Rect(0, 0, self.bar_width, self.bar_height)
+        bar.center = (self.width // 2, self.height // 2 + 10)
+        pygame.draw.rect(self.image, (26, 26, 26), bar)
+        track = bar.copy()
+        bar.width = int(self.bar_width * min(self.progress, 1))
+        pygame.draw.rect(self.image, self.game.accent_colour, bar)
+
+        status_rect = self.image.blit(
+            status_surface,
+            (
+                self.width // 2 - status_surface.get_width() // 2,
+                self.height // 2 + 30,
+            ),
+        )
+
+        # Only the text and the bar are ever drawn, the rest stays black
+        region = title_rect.union(status_rect).union(track)
+        self.game.window.blit(self.image, region, region)
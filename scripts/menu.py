@@ -12,11 +12,13 @@ class Menu:
         self.image.set_colorkey((0, 0, 0))
         self.rect = self.image.get_rect()
 
-        self.title_font = pygame.font.Font(
-            self.game.data / "fonts" / "Oswald-Regular.ttf", 52
-        )
-        self.subtitle_font = pygame.font.Font(
-            self.game.data / "fonts" / "Oswald-Regular.ttf", 16
+        self.title_font = self.game.load_font("Oswald-Regular.ttf", 52)
+        self.subtitle_font = self.game.load_font("Oswald-Regular.ttf", 16)
+
+        # A copy of its own, since its alpha changes every frame and the
+        # surfaces render_text returns are shared
+        self.subtitle_surface = self.subtitle_font.render(
+            "Press and key to continue", True, self.game.accent_colour
         )
 
     def update(self, frame):
@@ -24,13 +26,13 @@ class Menu:
 
     def render(self):
         self.image.fill((0, 0, 0))
-        title_surface = self.title_font.render("MIDI ARROW RUSH", True, (255, 255, 255))
-        subtitle_surface = self.subtitle_font.render(
-            "Press and key to continue", True, self.game.accent_colour
+        title_surface = self.game.render_text(
+            self.title_font, "MIDI ARROW RUSH", True, (255, 255, 255)
         )
+        subtitle_surface = self.subtitle_surface
         subtitle_surface.set_alpha(self.subtitle_opacity)
 
-        self.image.blit(
+        title_rect = self.image.blit(
             title_surface,
             (
                 self.image.get_width() // 2 - title_surface.get_width() // 2,
@@ -38,7 +40,7 @@ class Menu:
             ),
         )
 
-        self.image.blit(
+        subtitle_rect = self.image.blit(
             subtitle_surface,
             (
                 self.image.get_width() // 2 - subtitle_surface.get_width() // 2,
@@ -46,4 +48,6 @@ class Menu:
             ),
         )
 
-        self.game.window.screen.blit(self.image, self.rect)
\ No newline at end of file
+        # Only the text is ever drawn, the rest of the menu stays black
+        region = title_rect.union(subtitle_rect)
+        self.game.window.blit(self.image, region, region)
@@ -1,13 +1,45 @@
-import pretty_midi
-import pygame.midi
+import numpy as np
 
-pygame.midi.init()
+from .output import BACKENDS
+from .startup import startup
 
-PLAYER = pygame.midi.Output(0)
+_player = None
+_backend = "device"
+_backend_options = {}
+
+
+def select_player(backend, **options):
+    # Chooses the output that get_player opens, see output.BACKENDS
+    global _backend, _backend_options
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown MIDI backend {backend!r}")
+    close_player()
+    _backend = backend
+    _backend_options = options
+
+
+def get_player():
+    # The output is only opened once something needs to make a sound, so
+    # charts can be compiled without a MIDI device
+    global _player
+    if _player is None:
+        with startup.phase(f"open {_backend} MIDI output"):
+            _player = BACKENDS[_backend](**_backend_options)
+    return _player
+
+
+def close_player():
+    global _player
+    if _player is not None:
+        _player.close()
+        _player = None
 
 
 class MidiFile:
     def __init__(self, file, tempo=1):
+        # Only needed to compile charts, which are usually already cached
+        import pretty_midi
+
         self.file = str(file)
         self.data = pretty_midi.PrettyMIDI(self.file)
         self.tempo = 1 / tempo
@@ -25,7 +57,8 @@ class MidiFile:
     def intro(self, seconds):
         for notes in self.notes.values():
             for note in notes:
-                note.time += seconds * 60
+                note.time += int(seconds * 1000)
+                note.end_time += int(seconds * 1000)
 
     def get_instruments_by_index(self, *indexes):
         return [self.data.instruments[i] for i in indexes]
@@ -57,9 +90,17 @@ class MidiFile:
 
         return channels_by_instrument
 
-    def initialise_player(self):
-        for instrument, channel in self.channels.items():
-            PLAYER.set_instrument(instrument.program, channel)
+    def get_programs(self):
+        return [
+            (instrument.program, channel)
+            for instrument, channel in self.channels.items()
+        ]
+
+
+def initialise_player(programs, player=None):
+    player = player or get_player()
+    for program, channel in programs:
+        player.set_instrument(int(program), int(channel))
 
 
 class Note:
@@ -69,29 +110,105 @@ class Note:
         self.note = note
         self.duration = duration
         self.velocity = velocity
-        self.end_time = -1
+        self.end_time = time + duration
         self.played = False
         self.finished = False
         self.channel = channel
 
-    def update(self, frame):
-        if frame < self.time:
+    def update(self, now):
+        if now < self.time:
             self.played = False
-        if frame > self.time and frame and not self.played:
-            PLAYER.note_on(self.note, self.velocity, self.channel)
-            self.end_time = self.time + self.duration
+        if now > self.time and now and not self.played:
+            self.player.note_on(self.note, self.velocity, self.channel)
             self.played = True
-        elif frame == self.end_time:
-            PLAYER.note_off(self.note, self.velocity, self.channel)
+        elif self.played and not self.finished and now >= self.end_time:
+            # >= so that a dropped frame can never leave the note hanging
+            self.player.note_off(self.note, self.velocity, self.channel)
             self.finished = True
 
     @classmethod
     def from_midi_note(cls, midi_note, channel, tempo=1):
         return cls(
-            time=int(midi_note.start * 60 * tempo),
+            time=int(midi_note.start * 1000 * tempo),
             note=midi_note.pitch,
-            duration=int((midi_note.end - midi_note.start) * 60 * tempo),
+            duration=int((midi_note.end - midi_note.start) * 1000 * tempo),
             velocity=midi_note.velocity,
-            player=PLAYER,
+            player=None,
             channel=channel,
         )
+
+
+class NoteScheduler:
+    NOTE_OFF = 0
+    NOTE_ON = 1
+
+    def __init__(self, times, events, player=None):
+        # times is sorted; each row of events is (kind, note, velocity, channel)
+        self.player = player
+        self.times = times
+        self.events = events
+        self.cursor = 0
+        self.sounding = set()
+
+    @classmethod
+    def from_notes(cls, notes):
+        events = []
+        for note in notes:
+            events.append(
+                (note.time, cls.NOTE_ON, note.note, note.velocity, note.channel)
+            )
+            events.append(
+                (
+                    note.time + max(note.duration, 1),
+                    cls.NOTE_OFF,
+                    note.note,
+                    note.velocity,
+                    note.channel,
+                )
+            )
+        # Note-offs sort before note-ons at the same time so retriggered
+        # pitches are released before they are struck again
+        events.sort(key=lambda e: (e[0], e[1]))
+
+        return cls(
+            np.array([e[0] for e in events], dtype=np.int64),
+            np.array([e[1:] for e in events], dtype=np.uint8).reshape(-1, 4),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.times)
+
+    def due(self, until):
+        # Every event up to and including until that has not been taken yet,
+        # as (time, kind, note, velocity, channel) rows
+        end = int(np.searchsorted(self.times, until, side="right"))
+        if end <= self.cursor:
+            return []
+
+        events = [
+            (time, *event)
+            for time, event in zip(
+                self.times[self.cursor : end].tolist(),
+                self.events[self.cursor : end].tolist(),
+            )
+        ]
+        for _, kind, note, _, channel in events:
+            if kind == self.NOTE_ON:
+                self.sounding.add((note, channel))
+            else:
+                self.sounding.discard((note, channel))
+        self.cursor = end
+        return events
+
+    def seek(self, now):
+        self.stop()
+        self.cursor = int(np.searchsorted(self.times, now, side="left"))
+
+    def stop(self):
+        for note, channel in self.sounding:
+            self.player.note_off(note, 0, channel)
+        self.sounding.clear()
@@ -0,0 +1,101 @@
+import time
+
+import pygame.midi
+
+
+class MidiOutput:
+
+    # MIDI status bytes and controllers
+    NOTE_OFF = 0x80
+    NOTE_ON = 0x90
+    CONTROL_CHANGE = 0xB0
+    PROGRAM_CHANGE = 0xC0
+    ALL_NOTES_OFF = 123
+    CHANNELS = 16
+
+    # Output.write refuses more events than this in one call
+    MAX_WRITE = 1024
+
+    def __init__(self):
+        # Events are queued as [[status, data1, data2], timestamp] and only
+        # sent on flush, so a whole frame goes out in one write
+        self.pending = []
+
+    def time(self):
+        return int(time.perf_counter() * 1000)
+
+    def write(self, events):
+        self.pending.extend(events)
+
+    def note_on(self, note, velocity, channel):
+        self.pending.append([[self.NOTE_ON | channel, note, velocity], self.time()])
+
+    def note_off(self, note, velocity, channel):
+        self.pending.append([[self.NOTE_OFF | channel, note, velocity], self.time()])
+
+    def set_instrument(self, program, channel):
+        self.pending.append([[self.PROGRAM_CHANGE | channel, program, 0], self.time()])
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for i in range(0, len(pending), self.MAX_WRITE):
+            self.send(pending[i : i + self.MAX_WRITE])
+
+    def send(self, events):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class DeviceOutput(MidiOutput):
+    def __init__(self, device_id=None, latency=1):
+        # latency has to be above zero for the device to honour timestamps
+        super().__init__()
+        pygame.midi.init()
+        if device_id is None:
+            device_id = pygame.midi.get_default_output_id()
+            if device_id == -1:
+                raise RuntimeError("No MIDI output device found")
+        self.output = pygame.midi.Output(device_id, latency=latency)
+
+    def time(self):
+        return pygame.midi.time()
+
+    def send(self, events):
+        self.output.write(events)
+
+    def close(self):
+        super().close()
+        self.output.close()
+
+
+class NullOutput(MidiOutput):
+    def send(self, events):
+        pass
+
+
+class RecordingOutput(MidiOutput):
+    def __init__(self, path=None):
+        super().__init__()
+        self.events = []
+        self.file = open(path, "w") if path is not None else None
+
+    def send(self, events):
+        self.events.extend(events)
+        if self.file is not None:
+            for (status, data1, data2), timestamp in events:
+                self.file.write(f"{timestamp} {status} {data1} {data2}\n")
+
+    def close(self):
+        super().close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+BACKENDS = {
+    "device": DeviceOutput,
+    "null": NullOutput,
+    "record": RecordingOutput,
+}
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .chart import compile_song
+
+
+class ChartPrefetcher:
+    def __init__(self, charts, workers=1, memory_limit=64 * 1024 * 1024):
+        self.charts = charts
+        self.memory_limit = memory_limit
+
+        # Charts are compiled in worker processes, so parsing the MIDI never
+        # holds the game's GIL, and come back through the cache. The workers
+        # are only started on the first prefetch.
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.compiled = OrderedDict()
+        self.memory = 0
+
+        # At most one compile runs at a time. ProcessPoolExecutor hands calls
+        # to its workers ahead of time, so a queued one can't be cancelled.
+        # Songs highlighted while a compile runs just replace each other, and
+        # only the last one is compiled once it finishes.
+        self.song_file = None
+        self.difficulties = []
+        self.submitted = None
+        self.job = None
+        self.future = None
+
+    def prefetch(self, song_file, difficulties):
+        self.collect()
+        song_file = Path(song_file)
+        if song_file != self.song_file:
+            self.song_file = song_file
+            self.difficulties = list(difficulties)
+        if self.future is not None or self.song_file == self.submitted:
+            return
+
+        self.submitted = self.song_file
+        if all(key in self.compiled for key in self.keys(song_file, self.difficulties)):
+            return
+        self.job = song_file, self.difficulties
+        self.future = self.executor.submit(
+            compile_song, self.charts.directory, song_file
+        )
+
+    def keys(self, song_file, difficulties):
+        return [(song_file, difficulty) for difficulty in difficulties]
+
+    def collect(self):
+        # Once the worker is done the charts are memory-mapped from the
+        # cache, which is quick enough to do between frames
+        future = self.future
+        if future is None or not future.done():
+            return
+        self.future = None
+        if future.cancelled() or future.exception() is not None:
+            return
+        for key in self.keys(*self.job):
+            if key not in self.compiled:
+                self.store(key, self.charts.load(*key))
+
+    def store(self, key, compiled):
+        if compiled.nbytes > self.memory_limit:
+            return
+        self.compiled[key] = compiled
+        self.memory += compiled.nbytes
+        while self.memory > self.memory_limit:
+            _, evicted = self.compiled.popitem(last=False)
+            self.memory -= evicted.nbytes
+
+    def get(self, song_file, difficulty):
+        self.collect()
+        key = (Path(song_file), difficulty)
+        compiled = self.compiled.get(key)
+        if compiled is not None:
+            self.compiled.move_to_end(key)
+        return compiled
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,186 @@
+import csv
+import json
+import sys
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+import pygame
+
+
+class Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.spans.append((self.name, self.start, time.perf_counter()))
+
+
+class FrameProfiler:
+
+    # Parts of every frame of the main loop, in the order they happen
+    PHASES = ("input", "update", "render", "overlay", "display", "wait")
+    COLOURS = (
+        (90, 160, 255),
+        (90, 220, 120),
+        (240, 200, 60),
+        (200, 120, 255),
+        (230, 110, 60),
+        (110, 110, 110),
+    )
+    FRAMES = 600
+    SPANS = 50000
+
+    GRAPH_FRAMES = 240
+    GRAPH_HEIGHT = 100
+    # Milliseconds of frame time at the top of the graph
+    GRAPH_SCALE = 50
+
+    def __init__(self, size=FRAMES):
+        # Phase times are always kept, they only cost a few clock reads a
+        # frame. Spans and the overlay only run while enabled.
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.size = size
+        self.starts = np.zeros(size)
+        self.phases = np.zeros((size, len(self.PHASES)))
+        self.columns = {name: i for i, name in enumerate(self.PHASES)}
+        self.frames = 0
+        self.row = 0
+        self.last = self.origin
+        self.spans = deque(maxlen=self.SPANS)
+        self.no_span = nullcontext()
+        self.text = []
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.spans.clear()
+
+    def span(self, name):
+        if not self.enabled:
+            return self.no_span
+        return Span(self, name)
+
+    def start_frame(self):
+        self.last = time.perf_counter()
+        self.row = self.frames % self.size
+        self.frames += 1
+        self.starts[self.row] = self.last
+        self.phases[self.row] = 0
+
+    def mark(self, phase):
+        # Ends phase, which started at the previous mark
+        now = time.perf_counter()
+        self.phases[self.row, self.columns[phase]] = now - self.last
+        self.last = now
+
+    def history(self):
+        # Start times and phase times of finished frames, oldest first
+        count = min(self.frames - 1, self.size - 1)
+        order = (self.row - np.arange(count, 0, -1)) % self.size
+        return self.starts[order], self.phases[order]
+
+    def render(self, game):
+        if not self.enabled:
+            return
+        starts, phases = self.history()
+        if not len(phases):
+            return
+        totals = phases.sum(axis=1) * 1000
+        overlay = pygame.Surface((self.GRAPH_FRAMES * 2, self.GRAPH_HEIGHT + 120))
+        overlay.set_alpha(200)
+
+        # One bar per frame, stacked by phase, drawn as a pixel array
+        recent = phases[-self.GRAPH_FRAMES :] * 1000 / self.GRAPH_SCALE
+        tops = np.cumsum(recent * self.GRAPH_HEIGHT, axis=1)
+        rows = np.arange(self.GRAPH_HEIGHT)[::-1]
+        phase = (rows[None, :, None] >= tops[:, None, :]).sum(axis=2)
+        palette = np.array(self.COLOURS + ((0, 0, 0),), dtype=np.uint8)
+        graph = np.zeros((self.GRAPH_FRAMES * 2, self.GRAPH_HEIGHT, 3), np.uint8)
+        graph[: len(phase) * 2] = palette[phase].repeat(2, axis=0)
+        overlay.blit(pygame.surfarray.make_surface(graph), (0, 0))
+
+        if game.frame_rate:
+            budget = self.GRAPH_HEIGHT - int(
+                1000 / game.frame_rate / self.GRAPH_SCALE * self.GRAPH_HEIGHT
+            )
+            pygame.draw.line(
+                overlay, (255, 255, 255), (0, budget), (overlay.get_width(), budget)
+            )
+
+        # The breakdown is only rendered twice a second to stay readable
+        if self.frames % 30 == 0 or not self.text:
+            font = game.load_font("Oswald-Regular.ttf", 14)
+            mean = phases.mean(axis=0) * 1000
+            peak = phases.max(axis=0) * 1000
+            lines = [
+                (
+                    f"frame    mean {totals.mean():6.2f} ms"
+                    f"  max {totals.max():6.2f} ms",
+                    (255, 255, 255),
+                )
+            ] + [
+                (f"{name:<8} mean {mean[i]:6.2f} ms  max {peak[i]:6.2f} ms", colour)
+                for i, (name, colour) in enumerate(zip(self.PHASES, self.COLOURS))
+            ]
+            self.text = [font.render(line, True, colour) for line, colour in lines]
+
+        for i, surface in enumerate(self.text):
+            overlay.blit(surface, (4, self.GRAPH_HEIGHT + 4 + i * 16))
+
+        game.window.blit(overlay, (10, 10))
+
+    def export(self, directory):
+        # Writes the kept frames as CSV and, with any spans, as a Chrome
+        # trace that chrome://tracing or Perfetto can open
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = time.strftime("profile-%Y%m%d-%H%M%S")
+        starts, phases = self.history()
+
+        csv_path = directory / f"{stem}.csv"
+        with csv_path.open("w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["start_ms", *(f"{p}_ms" for p in self.PHASES), "total_ms"])
+            for start, row in zip(starts.tolist(), phases.tolist()):
+                writer.writerow(
+                    [
+                        round((start - self.origin) * 1000, 3),
+                        *(round(t * 1000, 3) for t in row),
+                        round(sum(row) * 1000, 3),
+                    ]
+                )
+
+        events = []
+        for start, row in zip(starts.tolist(), phases.tolist()):
+            events.append(self.event("frame", start, sum(row), "frame"))
+            for phase, seconds in zip(self.PHASES, row):
+                events.append(self.event(phase, start, seconds, "phase"))
+                start += seconds
+        for name, start, end in self.spans:
+            events.append(self.event(name, start, end - start, "span"))
+
+        trace_path = directory / f"{stem}.json"
+        with trace_path.open("w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+        print(f"Profile written to {csv_path} and {trace_path}", file=sys.stderr)
+        return csv_path, trace_path
+
+    def event(self, name, start, seconds, category):
+        return {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self.origin) * 1e6, 1),
+            "dur": round(seconds * 1e6, 1),
+            "pid": 1,
+            "tid": 1,
+        }
+
+
+profiler = FrameProfiler()
@@ -2,6 +2,16 @@ import pygame
 
 
 class Score:
+
+    # Name, how far either side of the note in milliseconds and points
+    JUDGEMENTS = (
+        ("Perfect", 40, 50),
+        ("Great", 80, 35),
+        ("Good", 125, 25),
+    )
+    HIT_WINDOW = JUDGEMENTS[-1][1]
+    MISS_PENALTY = 100
+
     def __init__(self, game):
         self.game = game
 
@@ -10,13 +20,17 @@ class Score:
         self._score = 0
         self._streak = 0
         self.max_streak = 0
+        self.judgement = None
+        self.judgements = dict.fromkeys(
+            [name for name, _, _ in self.JUDGEMENTS] + ["Miss"], 0
+        )
 
         self.width = 400
         self.height = 180
 
         self.score_font_size = 50
         self.streak_font_size = 15
-        self.font_family = self.game.data / "fonts" / "Oswald-Regular.ttf"
+        self.font_family = "Oswald-Regular.ttf"
 
         self.image = pygame.Surface((self.width, self.height))
         self.rect = self.image.get_rect()
@@ -44,6 +58,27 @@ class Score:
         if self._streak > self.max_streak:
             self.max_streak = val
 
+    def hit(self, offset):
+        # offset is how many milliseconds late (or early, if negative) the
+        # key was pressed
+        for name, window, points in self.JUDGEMENTS:
+            if abs(offset) <= window:
+                self.value += points
+                self.streak += 1
+                self.judge(name)
+                return name
+        self.miss()
+        return "Miss"
+
+    def miss(self, penalty=0):
+        self.value -= penalty
+        self.streak = 0
+        self.judge("Miss")
+
+    def judge(self, name):
+        self.judgement = name
+        self.judgements[name] += 1
+
     def update(self, frame):
         if self._animation_to_score != int(self._score):
             distance = self._animation_to_score - self._score
@@ -59,30 +94,49 @@ class Score:
     def render(self):
         self.image.fill((0, 0, 0))
 
-        score_font = pygame.font.Font(self.font_family, self.score_font_size)
-        streak_font = pygame.font.Font(self.font_family, self.streak_font_size)
-
-        score_surface = score_font.render(str(int(self._score)), True, (255, 255, 255))
-        streak_surface = streak_font.render(
-            "Streak: " + str(self.streak) + "  |  Max Streak: " + str(self.max_streak),
-            True,
-            (255, 255, 255),
+        streak_font = self.game.load_font(self.font_family, self.streak_font_size)
+        score_glyphs = self.game.load_glyphs(
+            self.font_family, self.score_font_size, (255, 255, 255)
+        )
+        streak_glyphs = self.game.load_glyphs(
+            self.font_family, self.streak_font_size, (255, 255, 255)
         )
 
-        self.image.blit(
-            streak_surface,
+        # The score changes almost every frame while it animates, so it is
+        # drawn from single characters instead of rendered as a whole
+        score = str(int(self._score))
+        streak = f"Streak: {self.streak}  |  Max Streak: {self.max_streak}"
+
+        streak_glyphs.render_to(
+            self.image,
+            streak,
             (
-                self.width // 2 - streak_surface.get_width() // 2,
-                self.height // 2 + score_surface.get_height() // 2,
+                self.width // 2 - streak_glyphs.width(streak) // 2,
+                self.height // 2 + score_glyphs.height // 2,
             ),
         )
 
-        self.image.blit(
-            score_surface,
+        score_glyphs.render_to(
+            self.image,
+            score,
             (
-                self.width // 2 - score_surface.get_width() // 2,
-                self.height // 2 - score_surface.get_height() // 2,
+                self.width // 2 - score_glyphs.width(score) // 2,
+                self.height // 2 - score_glyphs.height // 2,
             ),
         )
 
-        self.game.window.screen.blit(self.image, self.rect)
\ No newline at end of file
+        if self.judgement is not None:
+            judgement_surface = self.game.render_text(
+                streak_font, self.judgement.upper(), True, self.game.accent_colour
+            )
+            self.image.blit(
+                judgement_surface,
+                (
+                    self.width // 2 - judgement_surface.get_width() // 2,
+                    self.height // 2
+                    - score_glyphs.height // 2
+                    - judgement_surface.get_height(),
+                ),
+            )
+
+        self.game.window.blit(self.image, self.rect)
@@ -0,0 +1,133 @@
+import threading
+
+from .midi import get_player
+from .output import MidiOutput
+
+
+class Sequencer:
+
+    # Indexed by NoteScheduler.NOTE_OFF and NOTE_ON
+    STATUS = (MidiOutput.NOTE_OFF, MidiOutput.NOTE_ON)
+
+    def __init__(self, clock, lookahead=50, interval=0.005):
+        # lookahead is how many milliseconds of the backing track are handed
+        # to the device ahead of time, interval how often the thread wakes
+        self.clock = clock
+        self.lookahead = lookahead
+        self.interval = interval
+
+        # Outputs are not thread safe, every write goes through this
+        self.lock = threading.RLock()
+        self.active = False
+        self.scheduler = None
+        self.horizon = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def player(self):
+        return get_player()
+
+    def play(self, scheduler=None):
+        # Without a scheduler only notes sent through note_on and note_off
+        # are played, for when the backing track is audio
+        self.stop()
+        with self.lock:
+            self.active = True
+            self.player.flush()
+            if scheduler is None:
+                return
+            scheduler.player = self
+            scheduler.seek(self.clock.now())
+            self.scheduler = scheduler
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(scheduler, self.stopped),
+            name="sequencer",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def run(self, scheduler, stopped):
+        while not stopped.is_set():
+            self.send(scheduler, self.clock.now() + self.lookahead)
+            stopped.wait(self.interval)
+
+    def send(self, scheduler, until):
+        with self.lock:
+            events = scheduler.due(until)
+            if not events:
+                return
+
+            # Song time is mapped onto the device's clock so it can play each
+            # event at exactly the right moment, whenever it was written
+            offset = self.player.time() - self.clock.now()
+            data = [
+                [[self.STATUS[kind] | channel, note, velocity], time + offset]
+                for time, kind, note, velocity, channel in events
+            ]
+            self.player.write(data)
+            self.player.flush()
+            self.horizon = max(self.horizon, data[-1][1])
+
+    def seek(self, now):
+        with self.lock:
+            if self.scheduler is not None:
+                self.scheduler.seek(now)
+                self.all_notes_off()
+                self.player.flush()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        with self.lock:
+            if not self.active:
+                return
+            if self.scheduler is not None:
+                self.scheduler.stop()
+                self.scheduler = None
+            self.all_notes_off()
+            self.player.flush()
+            self.active = False
+
+    def flush(self):
+        # Sends whatever the game loop queued this frame, such as hit notes
+        with self.lock:
+            if self.active:
+                self.player.flush()
+
+    def all_notes_off(self):
+        # Stamped after everything already handed to the device, so nothing
+        # that was queued ahead can ring on
+        with self.lock:
+            when = max(self.player.time(), self.horizon)
+            self.player.write(
+                [
+                    [
+                        [
+                            MidiOutput.CONTROL_CHANGE | channel,
+                            MidiOutput.ALL_NOTES_OFF,
+                            0,
+                        ],
+                        when,
+                    ]
+                    for channel in range(MidiOutput.CHANNELS)
+                ]
+            )
+
+    def note_on(self, note, velocity, channel):
+        with self.lock:
+            self.player.note_on(note, velocity, channel)
+
+    def note_off(self, note, velocity, channel):
+        with self.lock:
+            self.player.note_off(note, velocity, channel)
+
+    def set_instrument(self, program, channel):
+        with self.lock:
+            self.player.set_instrument(program, channel)
@@ -0,0 +1,37 @@
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupTrace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = False
+        self.reported = False
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases.append((name, seconds))
+            # Anything built lazily after the menu is up is shown as it happens
+            if self.enabled and self.reported:
+                self.print(name, seconds)
+
+    def report(self):
+        # Called once the first frame is on screen
+        if self.enabled and not self.reported:
+            for name, seconds in self.phases:
+                self.print(name, seconds)
+            self.print("first frame", time.perf_counter() - self.start)
+        self.reported = True
+
+    def print(self, name, seconds):
+        print(f"{seconds * 1000:8.1f} ms  {name}", file=sys.stderr)
+
+
+startup = StartupTrace()
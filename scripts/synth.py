@@ -0,0 +1,205 @@
+import hashlib
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from .chart import atomic_path, no_progress
+from .midi import NoteScheduler
+
+DRUM_CHANNEL = 9
+WAVETABLE_SIZE = 2048
+
+
+def wavetable(*harmonics):
+    # One cycle of a wave made of the given harmonic amplitudes
+    phase = np.arange(WAVETABLE_SIZE) / WAVETABLE_SIZE * 2 * np.pi
+    table = sum(a * np.sin((k + 1) * phase) for k, a in enumerate(harmonics))
+    return (table / np.abs(table).max()).astype(np.float32)
+
+
+class Timbre:
+    def __init__(self, table, attack, decay, release, sustain=0.0):
+        # attack and release in seconds, decay is the time constant of the
+        # fall from full volume towards the sustain level
+        self.table = table
+        self.attack = attack
+        self.decay = decay
+        self.release = release
+        self.sustain = sustain
+
+
+# General MIDI program families (program // 8) to a rough sound for each
+BRIGHT = Timbre(wavetable(1, 0.5, 0.33, 0.25, 0.2), 0.005, 0.6, 0.08)
+TIMBRES = {
+    0: Timbre(wavetable(1, 0.4, 0.2, 0.1), 0.003, 0.5, 0.1),  # piano
+    1: Timbre(wavetable(1, 0, 0.3, 0, 0.1), 0.001, 0.3, 0.05),  # chromatic
+    2: Timbre(wavetable(1, 0.6, 0.4, 0.3), 0.01, 10, 0.05, 1),  # organ
+    3: Timbre(wavetable(1, 0.3, 0.2, 0.15), 0.002, 0.4, 0.08),  # guitar
+    4: Timbre(wavetable(1, 0.2), 0.005, 0.8, 0.05, 0.5),  # bass
+    5: Timbre(wavetable(1, 0.5, 0.3, 0.2, 0.1), 0.05, 10, 0.2, 1),  # strings
+    6: Timbre(wavetable(1, 0.5, 0.3, 0.2, 0.1), 0.05, 10, 0.2, 1),  # ensemble
+    7: Timbre(wavetable(1, 0.3, 0.4, 0.1), 0.02, 10, 0.1, 1),  # brass
+    8: Timbre(wavetable(1, 0, 0.5, 0, 0.3), 0.02, 10, 0.1, 1),  # reed
+    9: Timbre(wavetable(1, 0.1), 0.03, 10, 0.1, 1),  # pipe
+}
+
+
+def backing_notes(compiled):
+    # Pairs the backing track's note on and off events back up into notes
+    # of (start, end, pitch, velocity, channel)
+    starts = {}
+    notes = []
+    for time, (kind, pitch, velocity, channel) in zip(
+        compiled.backing_time.tolist(), compiled.backing_events.tolist()
+    ):
+        key = pitch, channel
+        if kind == NoteScheduler.NOTE_ON:
+            starts.setdefault(key, []).append((time, velocity))
+        elif starts.get(key):
+            start, velocity = starts[key].pop(0)
+            notes.append((start, time, pitch, velocity, channel))
+    return notes
+
+
+class Synth:
+
+    # Bump whenever the sound changes so cached tracks are rendered again
+    VERSION = 1
+    VOLUME = 0.15
+    # Held notes never ring on for longer than this many seconds
+    MAX_NOTE = 4
+
+    def __init__(self, sample_rate=44100):
+        self.sample_rate = sample_rate
+        self.rng = np.random.default_rng(0)
+
+    def render(self, compiled, progress=no_progress):
+        programs = {
+            int(channel): int(program) for program, channel in compiled.programs
+        }
+        notes = backing_notes(compiled)
+        length = max([end for _, end, _, _, _ in notes], default=0) / 1000 + 1
+        out = np.zeros(int(length * self.sample_rate), dtype=np.float32)
+
+        for i, (start, end, pitch, velocity, channel) in enumerate(notes):
+            if i % 256 == 0:
+                progress(i / max(len(notes), 1), "Rendering backing track")
+
+            if channel == DRUM_CHANNEL:
+                sound = self.drum(pitch)
+            else:
+                timbre = TIMBRES.get(programs.get(channel, 0) // 8, BRIGHT)
+                sound = self.note(timbre, pitch, (end - start) / 1000)
+
+            begin = int(start / 1000 * self.sample_rate)
+            sound = sound[: len(out) - begin]
+            out[begin : begin + len(sound)] += sound * (velocity / 127 * self.VOLUME)
+
+        peak = np.abs(out).max(initial=0)
+        if peak > 1:
+            out /= peak
+        return out
+
+    def note(self, timbre, pitch, duration):
+        rate = self.sample_rate
+        hold = int(min(duration, self.MAX_NOTE) * rate)
+        release = int(timbre.release * rate)
+        t = np.arange(hold + release, dtype=np.float32)
+
+        frequency = 440 * 2 ** ((pitch - 69) / 12)
+        index = (t * (frequency * WAVETABLE_SIZE / rate)).astype(np.int64)
+        wave = timbre.table[index % WAVETABLE_SIZE]
+
+        envelope = np.minimum(t / max(timbre.attack * rate, 1), 1)
+        envelope *= timbre.sustain + (1 - timbre.sustain) * np.exp(
+            -t / (timbre.decay * rate)
+        )
+        envelope[hold:] *= np.linspace(1, 0, release, dtype=np.float32)
+        return wave * envelope
+
+    def drum(self, pitch):
+        rate = self.sample_rate
+        t = np.arange(int(0.25 * rate), dtype=np.float32)
+        if pitch in (35, 36):
+            # Kick drums are a falling sine, everything else is noise
+            frequency = 50 + 100 * np.exp(-t / (0.03 * rate))
+            wave = np.sin(2 * np.pi * np.cumsum(frequency) / rate)
+            return (wave * np.exp(-t / (0.08 * rate))).astype(np.float32)
+        noise = self.rng.uniform(-1, 1, len(t)).astype(np.float32)
+        decay = 0.15 if pitch in (49, 51, 52, 55, 57, 59) else 0.04
+        return noise * np.exp(-t / (decay * rate)) * 0.6
+
+
+class BackingCache:
+    # Backing tracks rendered to 16-bit stereo WAV files, named after a hash
+    # of the events they were rendered from
+
+    def __init__(self, directory, sample_rate=44100):
+        self.directory = Path(directory)
+        self.synth = Synth(sample_rate)
+
+    def key(self, compiled):
+        digest = hashlib.sha1()
+        digest.update(f"v{Synth.VERSION}\0{self.synth.sample_rate}\0".encode())
+        for array in (
+            compiled.programs,
+            compiled.backing_time,
+            compiled.backing_events,
+        ):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def path(self, compiled):
+        return self.directory / f"{self.key(compiled)}.wav"
+
+    def cached(self, compiled):
+        return self.path(compiled).exists()
+
+    def load(self, compiled, progress=no_progress):
+        path = self.path(compiled)
+        if not path.exists():
+            samples = self.synth.render(compiled, progress)
+            progress(1, "Saving backing track")
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.save(path, samples)
+        return path
+
+    def save(self, path, samples):
+        rate = self.synth.sample_rate
+        data_size = len(samples) * 4
+        header = struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF",
+            36 + data_size,
+            b"WAVE",
+            b"fmt ",
+            16,
+            1,
+            2,
+            rate,
+            rate * 4,
+            4,
+            16,
+            b"data",
+            data_size,
+        )
+
+        with atomic_path(path) as tmp:
+            with tmp.open("wb") as f:
+                f.write(header)
+                f.truncate(len(header) + data_size)
+
+            # Converted a second at a time straight into the mapped file
+            pcm = np.memmap(
+                tmp,
+                dtype=np.int16,
+                mode="r+",
+                offset=len(header),
+                shape=(len(samples), 2),
+            )
+            for i in range(0, len(samples), rate):
+                chunk = (samples[i : i + rate] * 32767).astype(np.int16)
+                pcm[i : i + rate] = chunk[:, None]
+            pcm.flush()
+            del pcm
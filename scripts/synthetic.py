@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+LOWEST_NOTE = 36
+HIGHEST_NOTE = 96
+
+
+def write_song(
+    directory, name, notes, chord_size=1, instruments=2, seconds=None, seed=0
+):
+    # Writes name.mid and name.json into directory, with about notes notes
+    # shared between instruments, struck chord_size at a time, over seconds
+    # seconds (10 chords per second per instrument if not given).
+    # Returns the path of the song JSON.
+    import pretty_midi
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    chords = max(-(-notes // (chord_size * instruments)), 1)
+    if seconds is None:
+        seconds = chords / 10
+
+    midi = pretty_midi.PrettyMIDI()
+    for i in range(instruments):
+        # A different General MIDI family for each instrument
+        instrument = pretty_midi.Instrument(program=i * 8 % 128)
+
+        starts = np.sort(rng.uniform(0, seconds, chords))
+        lengths = rng.uniform(0.05, 0.5, chords)
+        roots = rng.integers(LOWEST_NOTE, HIGHEST_NOTE - 12, chords)
+        velocities = rng.integers(60, 120, chords)
+        for start, length, root, velocity in zip(
+            starts.tolist(), lengths.tolist(), roots.tolist(), velocities.tolist()
+        ):
+            for pitch in range(root, root + chord_size * 4, 4):
+                instrument.notes.append(
+                    pretty_midi.Note(
+                        velocity, min(pitch, HIGHEST_NOTE), start, start + length
+                    )
+                )
+        midi.instruments.append(instrument)
+
+    midi.write(str(directory / f"{name}.mid"))
+
+    song_file = directory / f"{name}.json"
+    with song_file.open("w") as f:
+        json.dump(
+            {
+                "midi": f"{name}.mid",
+                "name": name,
+                "artist": "Synthetic",
+                "levels": [[0], list(range(instruments))],
+                "tempo": 1,
+            },
+            f,
+            indent=4,
+        )
+    return song_file
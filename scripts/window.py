@@ -5,14 +5,53 @@ class Window:
 
     WINDOW_SIZE = 1280, 720
 
-    def __init__(self, game):
+    def __init__(self, game, dirty_rects=False):
         self.game = game
 
         self.screen = pygame.display.set_mode(self.WINDOW_SIZE)
         pygame.display.set_caption(self.game.__class__.__name__)
 
+        # In dirty-rect mode only the regions components report as drawn are
+        # cleared and pushed to the display, instead of the whole framebuffer
+        self.dirty_rects = dirty_rects
+        self.dirty = []
+        self.transient = []
+        self.previous = []
+        self.full_update = True
+        self.shown_screen = None
+
+    def invalidate(self):
+        self.full_update = True
+
+    def blit(self, surface, dest, area=None, changed=True, opaque=False):
+        # Unchanged content is still on screen from a previous frame
+        if self.dirty_rects and not changed and not self.full_update:
+            return
+        rect = self.screen.blit(surface, dest, area)
+        self.dirty.append(rect)
+        # Opaque content overwrites itself, everything else is cleared before
+        # the next frame is drawn
+        if not opaque:
+            self.transient.append(rect)
+
     def update(self):
-        self.screen.fill((0, 0, 0))
+        if self.game.screen != self.shown_screen:
+            self.shown_screen = self.game.screen
+            self.invalidate()
+
+        if not self.dirty_rects or self.full_update:
+            self.screen.fill((0, 0, 0))
+        else:
+            for rect in self.previous:
+                self.screen.fill((0, 0, 0), rect)
 
     def render(self):
-        pygame.display.update()
\ No newline at end of file
+        if not self.dirty_rects or self.full_update:
+            pygame.display.update()
+        else:
+            pygame.display.update(self.previous + self.dirty)
+
+        self.full_update = False
+        self.previous = self.transient
+        self.transient = []
+        self.dirty = []